@@ -1,15 +1,20 @@
-from flask import Flask, render_template, jsonify, request, send_from_directory, redirect, url_for, session
+from flask import Flask, render_template, jsonify, request, send_file, redirect, url_for, session, Response, stream_with_context
 import os
+import re
 import json
 import subprocess
 import psutil
 import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime, timedelta
 import uuid
 import shutil
 import threading
-from queue import Queue
+from queue import Queue, Empty, Full
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, wait
 import base64
 import hashlib
 import functools
@@ -17,22 +22,163 @@ from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 from apscheduler.triggers.interval import IntervalTrigger
 from apscheduler.triggers.date import DateTrigger
+from apscheduler.events import EVENT_JOB_SUBMITTED, EVENT_JOB_MISSED
 import zipfile
+import tarfile
+import zlib
+import math
+import mmap
+import struct
+import glob
+import atexit
+import sqlite3
+from urllib.parse import quote
 from shutil import which
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 app = Flask(__name__)
 
 # 全局变量
 minecraft_processes = {}
 config = None
 download_status = {}
-download_queue = Queue()
-command_history = {}
-scheduler = BackgroundScheduler()
+# 定时任务：调度器只负责按时把任务提交给后台任务线程池
+# 错过的多次执行合并为一次，超过宽限时间的执行直接跳过（面板停机期间错过的也按此处理）
+SCHEDULER_MISFIRE_GRACE = 300
+scheduler = BackgroundScheduler(job_defaults={
+    'coalesce': True,
+    'max_instances': 1,
+    'misfire_grace_time': SCHEDULER_MISFIRE_GRACE
+})
 
 # 定时任务存储
 scheduled_tasks = {}
 
+# 服务器生命周期：stopped → starting → running → stopping → stopped，意外退出为crashed
+# 启停由后台线程完成，接口立即返回，状态通过状态接口和推送查看
+SERVER_READY_PATTERN = re.compile(r'^Done \([\d.,]+s\)!')
+SERVER_START_TIMEOUT = 300
+# 停止时先发送stop命令等待保存退出，超时后terminate，再超时kill
+SERVER_STOP_TIMEOUT = 60
+SERVER_TERMINATE_TIMEOUT = 10
+# 记录服务器进程PID，启动前据此确认目录没有被其他进程（如另一个面板进程）中的服务器占用
+SERVER_PID_FILE = os.path.join('logs', 'panel-server.pid')
+# 控制台输入这些命令时改走正常停止流程，避免被当成崩溃
+SERVER_STOP_COMMANDS = ('stop', 'end')
+# 崩溃后自动重启：等待时间从initial_delay开始每次翻倍，crash_window秒内崩溃超过max_crashes次后不再重启
+DEFAULT_AUTO_RESTART = {
+    "enabled": True,
+    "initial_delay": 5,
+    "max_delay": 300,
+    "max_crashes": 5,
+    "crash_window": 600
+}
+server_lifecycles = {}
+server_lifecycles_lock = threading.Lock()
+
+# 日志读取参数
+LOG_TAIL_LINES = 100
+LOG_READ_BLOCK = 8192
+LOG_MAX_READ = 1024 * 1024
+# 每次启动服务器时递增，用于让客户端的日志游标失效
+log_generations = {}
+
+# 进程资源采样：后台线程定时采样，接口只读取缓存
+RESOURCE_SAMPLE_INTERVAL = 1.0
+process_handles = {}
+process_samples = {}
+host_stats = {}
+
+# 历史指标：秒级数据只在内存中保留1小时，分钟和小时汇总持久化到metrics目录
+METRICS_DIR = 'metrics'
+METRIC_ARCHIVES = [
+    # (步长秒数, 槽位数量, 是否持久化)
+    (1, 3600, False),
+    (60, 7 * 24 * 60, True),
+    (3600, 365 * 24, True)
+]
+METRIC_MAX_POINTS = 2000
+METRIC_DEFAULT_POINTS = 360
+SERVER_METRIC_FIELDS = ('cpu_percent', 'memory_mb', 'players')
+HOST_METRIC_FIELDS = ('cpu_percent', 'memory_percent', 'disk_percent', 'net_sent_rate', 'net_recv_rate')
+metric_stores = {}
+metric_stores_lock = threading.Lock()
+
+# 备份：zip为完整压缩包，snapshot为按内容寻址去重的增量快照
+BACKUP_MODES = ('zip', 'snapshot')
+# 完整备份的压缩方式及默认级别；zstd生成多线程压缩的tar.zst
+BACKUP_CODECS = {
+    'deflate': 6,
+    'store': 0,
+    'zstd': 3
+}
+# 各压缩方式允许的级别范围，store不压缩，忽略级别
+BACKUP_CODEC_LEVELS = {
+    'deflate': (0, 9),
+    'zstd': (1, 22)
+}
+# 这些格式本身已经压缩过（区块文件、NBT、jar等），再压缩几乎没有收益，直接存储
+PRECOMPRESSED_EXTENSIONS = {
+    '.jar', '.zip', '.mca', '.mcr', '.mcc', '.dat', '.dat_old', '.nbt', '.gz', '.tgz',
+    '.xz', '.bz2', '.zst', '.7z', '.rar', '.png', '.jpg', '.jpeg', '.ogg', '.mp3'
+}
+BACKUP_COMPRESS_WORKERS = os.cpu_count() or 1
+# 超过此大小的文件不放进进程池，避免把整个压缩结果留在内存中
+BACKUP_PARALLEL_MAX_MEMBER = 64 * 1024 * 1024
+# 热备份：等待save-all完成的超时时间，以及各版本服务端保存完成时输出的日志
+HOT_BACKUP_SAVE_TIMEOUT = 60
+SAVE_COMPLETE_PATTERN = re.compile(r'^(Saved the (game|world)|ALL chunks are saved|Saving\.\.\. ?Done)', re.IGNORECASE)
+# Linux上的FICLONE ioctl，用于在btrfs/xfs等文件系统上创建写时复制副本
+FICLONE = 0x40049409
+# 服务端不会原地修改这些文件，暂存时可以直接硬链接
+HOT_BACKUP_LINK_EXTENSIONS = {'.jar'}
+# 备份目录索引，列表和保留策略都查询这里，不再逐个扫描备份文件
+BACKUP_CATALOG_FILE = os.path.join('config', 'backups.db')
+BACKUP_SORT_FIELDS = {
+    'time': 'time',
+    'size': 'size_bytes',
+    'duration': 'duration',
+    'file_count': 'file_count'
+}
+SNAPSHOT_CHUNK_SIZE = 1024 * 1024
+# 恢复时先写入临时文件再替换，避免中断后留下半个文件
+RESTORE_TEMP_SUFFIX = '.ems-restore'
+RESTORE_BLOCK_SIZE = 1024 * 1024
+SNAPSHOT_COMPRESS_LEVEL = 3
+backup_locks = {}
+backup_locks_lock = threading.Lock()
+
+# Prometheus指标：只从缓存数据生成，抓取时不做任何采样
+HTTP_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+last_backup_stats = {}
+scheduler_job_lag = {}
+scheduler_missed_jobs = 0
+
+# 在线玩家跟踪：根据日志中的加入/离开记录维护，偶尔用list命令校准
+PLAYER_TRACK_INTERVAL = 1.0
+PLAYER_RECONCILE_INTERVAL = 300
+PLAYER_JOIN_PATTERN = re.compile(r'^(\w{1,16}) (?:\(formerly known as \w+\) )?joined the game$')
+PLAYER_LEAVE_PATTERN = re.compile(r'^(\w{1,16}) (?:left the game$|lost connection: )')
+PLAYER_LIST_PATTERN = re.compile(r'^There are (\d+)(?: of a max of |/)(\d+) players online:(.*)$')
+online_players = {}
+player_trackers = {}
+
+# 实时推送参数
+STREAM_POLL_INTERVAL = 0.5
+STREAM_HEARTBEAT = 15
+STREAM_QUEUE_SIZE = 256
+stream_hubs = {}
+stream_hubs_lock = threading.Lock()
+
 # OpenFrp API 基础URL
 OPENFRP_BASE_URL = "https://api.openfrp.net"
 
@@ -58,6 +204,35 @@ LOG_TRANSLATIONS = {
     "Invalid command syntax": "命令语法无效"
 }
 
+# 日志行前缀，翻译缓存只按正文部分命中。各服务端格式不同：
+# 原版 "[12:00:00] [Server thread/INFO]: "，Paper/Spigot "[12:00:00 INFO]: "，
+# Forge "[12:00:00] [Server thread/INFO] [minecraft/DedicatedServer]: "
+LOG_PREFIX_PATTERN = re.compile(r'^(\[[^\]]*\](?: \[[^\]]*\]){0,2}: )?(.*)$', re.S)
+LOG_TRANSLATION_CACHE_SIZE = 4096
+
+class LogTranslator:
+    """日志翻译器
+
+    把翻译表编译成一个正则，一次扫描完成全部替换；较长的词条优先匹配。
+    去掉时间前缀后的正文会进入LRU缓存，重复出现的日志不再重新匹配。
+    """
+    def __init__(self, translations):
+        self.translations = dict(translations)
+        keys = sorted(self.translations, key=len, reverse=True)
+        self.pattern = re.compile('|'.join(re.escape(key) for key in keys)) if keys else None
+        self._translate_message = functools.lru_cache(maxsize=LOG_TRANSLATION_CACHE_SIZE)(self._translate_message)
+
+    def _translate_message(self, message):
+        return self.pattern.sub(lambda m: self.translations[m.group(0)], message)
+
+    def translate(self, log_line):
+        if self.pattern is None:
+            return log_line
+        prefix, message = LOG_PREFIX_PATTERN.match(log_line).groups()
+        return (prefix or '') + self._translate_message(message)
+
+log_translator = LogTranslator(LOG_TRANSLATIONS)
+
 class OpenFrpAPI:
     def __init__(self, token, authorization):
         self.token = token
@@ -106,26 +281,403 @@ class OpenFrpAPI:
         except Exception as e:
             return {"success": False, "message": str(e)}
 
-def find_java_in_path():
-    """在系统PATH中查找默认的Java"""
-    try:
-        # 检查默认的java命令
-        process = subprocess.Popen(['java', '-version'], 
-                                stdout=subprocess.PIPE, 
-                                stderr=subprocess.PIPE,
-                                text=True)
-        _, stderr = process.communicate()
-        version = stderr.split('\n')[0]
+# Java运行时：每个可执行文件只探测一次，按真实路径缓存，文件变化（inode/修改时间/大小）后才重新探测
+JAVA_CACHE_FILE = os.path.join('cache', 'java.json')
+JAVA_EXECUTABLE = 'java.exe' if os.name == 'nt' else 'java'
+JAVA_SCAN_PATTERNS = [
+    '/usr/lib/jvm/*/bin/java',
+    '/usr/lib64/jvm/*/bin/java',
+    '/usr/java/*/bin/java',
+    '/opt/java/*/bin/java',
+    '/opt/*jdk*/bin/java',
+    '/Library/Java/JavaVirtualMachines/*/Contents/Home/bin/java',
+    '~/.sdkman/candidates/java/*/bin/java',
+    '~/.jdks/*/bin/java',
+    'C:\\Program Files\\Java\\*\\bin\\java.exe',
+    'C:\\Program Files\\Eclipse Adoptium\\*\\bin\\java.exe',
+    'C:\\Program Files\\Zulu\\*\\bin\\java.exe'
+]
+JAVA_PROBE_TIMEOUT = 15
+JAVA_PROBE_WORKERS = 4
+JAVA_PROPERTY_PATTERN = re.compile(r'^\s*(java\.version|java\.vendor|java\.vm\.name|os\.arch)\s*=\s*(.*)$')
+
+class JavaRegistry:
+    """Java运行时注册表，缓存版本、厂商和架构信息"""
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = None
+
+    def load(self):
+        if self.entries is None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+        return self.entries
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp = self.path + '.tmp'
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, indent=4, ensure_ascii=False)
+        os.replace(temp, self.path)
+
+    def probe(self, path):
+        """返回Java信息，路径无效或不是Java时返回None"""
+        executable = which(path) if os.path.basename(path) == path else path
+        if not executable or not os.path.isfile(executable):
+            return None
+        real_path = os.path.realpath(executable)
+        stat = os.stat(real_path)
+        key = [stat.st_ino, stat.st_mtime_ns, stat.st_size]
+        with self.lock:
+            entry = self.load().get(real_path)
+        if entry and entry['key'] == key:
+            info = entry['info']
+        else:
+            info = self.run_probe(real_path)
+            with self.lock:
+                self.load()[real_path] = {'key': key, 'info': info}
+                self.save()
+        return dict(info, path=path, real_path=real_path) if info else None
+
+    @staticmethod
+    def run_probe(executable):
+        startupinfo = None
+        if os.name == 'nt':
+            startupinfo = subprocess.STARTUPINFO()
+            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+            startupinfo.wShowWindow = subprocess.SW_HIDE
+        try:
+            result = subprocess.run(
+                [executable, '-XshowSettings:properties', '-version'],
+                capture_output=True, text=True, errors='ignore',
+                timeout=JAVA_PROBE_TIMEOUT, startupinfo=startupinfo
+            )
+        except (OSError, subprocess.TimeoutExpired):
+            return None
+        if result.returncode != 0:
+            return None
+        properties = {}
+        version_line = ''
+        for line in result.stderr.splitlines():
+            match = JAVA_PROPERTY_PATTERN.match(line)
+            if match:
+                properties[match.group(1)] = match.group(2).strip()
+            elif ' version "' in line and not version_line:
+                version_line = line.strip()
         return {
-            'path': 'java',
-            'version': version,
-            'is_default': True
+            'version': version_line or f"java version \"{properties.get('java.version', '')}\"",
+            'java_version': properties.get('java.version'),
+            'vendor': properties.get('java.vendor'),
+            'vm': properties.get('java.vm.name'),
+            'arch': properties.get('os.arch')
         }
-    except:
+
+    def discover(self):
+        """扫描常见的JDK安装位置，并行探测，已探测过且未变化的文件直接用缓存"""
+        candidates = []
+        java_home = os.environ.get('JAVA_HOME')
+        if java_home:
+            candidates.append(os.path.join(java_home, 'bin', JAVA_EXECUTABLE))
+        for pattern in JAVA_SCAN_PATTERNS:
+            candidates.extend(sorted(glob.glob(os.path.expanduser(pattern))))
+        unique = {}
+        for candidate in candidates:
+            if os.path.isfile(candidate):
+                unique.setdefault(os.path.realpath(candidate), candidate)
+        if not unique:
+            return []
+        with ThreadPoolExecutor(max_workers=JAVA_PROBE_WORKERS) as pool:
+            results = pool.map(self.probe, unique.values())
+        return [info for info in results if info]
+
+java_registry = JavaRegistry(JAVA_CACHE_FILE)
+
+def find_java_in_path():
+    """在系统PATH中查找默认的Java"""
+    info = java_registry.probe('java')
+    if not info:
         return None
+    return dict(info, path='java', is_default=True)
+
+# 配置持久化：短时间内的多次修改合并为一次写入，写入使用临时文件+fsync+替换
+CONFIG_PATH = os.path.join('config', 'config.json')
+CONFIG_SAVE_DELAY = 0.5
+config_lock = threading.RLock()
+config_save_timer = None
+# 最近一次写入磁盘的内容，没有变化时跳过写入
+config_saved_text = None
+
+# 面板状态库：服务器、定时任务、命令历史、玩家会话和后台任务记录，config.json只保留面板设置
+STATE_DB_FILE = os.path.join('config', 'state.db')
+COMMAND_HISTORY_LIMIT = 50
+CRASH_HISTORY_LIMIT = 50
+
+class StateStore:
+    """面板状态库（SQLite，WAL模式），各表按常用查询建立索引"""
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS servers (
+            id TEXT PRIMARY KEY,
+            name TEXT,
+            java_path TEXT,
+            data TEXT NOT NULL
+        )""",
+        'CREATE INDEX IF NOT EXISTS idx_servers_java ON servers (java_path)',
+        """CREATE TABLE IF NOT EXISTS tasks (
+            id TEXT PRIMARY KEY,
+            server_id TEXT,
+            type TEXT,
+            data TEXT NOT NULL
+        )""",
+        'CREATE INDEX IF NOT EXISTS idx_tasks_server ON tasks (server_id)',
+        """CREATE TABLE IF NOT EXISTS command_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            server_id TEXT NOT NULL,
+            command TEXT NOT NULL,
+            timestamp TEXT NOT NULL
+        )""",
+        'CREATE INDEX IF NOT EXISTS idx_command_history_server ON command_history (server_id, id)',
+        """CREATE TABLE IF NOT EXISTS player_sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            server_id TEXT NOT NULL,
+            player TEXT NOT NULL,
+            joined_at REAL NOT NULL,
+            left_at REAL
+        )""",
+        'CREATE INDEX IF NOT EXISTS idx_player_sessions_server ON player_sessions (server_id, joined_at)',
+        'CREATE INDEX IF NOT EXISTS idx_player_sessions_open ON player_sessions (server_id, player, left_at)',
+        """CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            type TEXT,
+            server_id TEXT,
+            status TEXT,
+            description TEXT,
+            progress REAL,
+            message TEXT,
+            error TEXT,
+            result TEXT,
+            created_at REAL,
+            started_at REAL,
+            finished_at REAL
+        )""",
+        'CREATE INDEX IF NOT EXISTS idx_jobs_server ON jobs (server_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status)',
+        """CREATE TABLE IF NOT EXISTS server_crashes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            server_id TEXT NOT NULL,
+            exit_code INTEGER,
+            crash_report TEXT,
+            log_file TEXT,
+            crashed_at REAL NOT NULL
+        )""",
+        'CREATE INDEX IF NOT EXISTS idx_server_crashes_server ON server_crashes (server_id, crashed_at)'
+    ]
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn = None
+        # 最近写入的服务器配置，只更新有变化的行
+        self.server_texts = {}
+
+    def connect(self):
+        if self.conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.row_factory = sqlite3.Row
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            for statement in self.SCHEMA:
+                self.conn.execute(statement)
+            # 早期版本的崩溃记录表没有保存日志路径
+            columns = {row['name'] for row in self.conn.execute('PRAGMA table_info(server_crashes)')}
+            if 'log_file' not in columns:
+                self.conn.execute('ALTER TABLE server_crashes ADD COLUMN log_file TEXT')
+            self.conn.commit()
+        return self.conn
+
+    def execute(self, sql, params=()):
+        with self.lock:
+            cursor = self.connect().execute(sql, params)
+            self.conn.commit()
+            return cursor
+
+    def query(self, sql, params=()):
+        with self.lock:
+            return [dict(row) for row in self.connect().execute(sql, params).fetchall()]
+
+    # 服务器
+    def load_servers(self):
+        servers = {}
+        for row in self.query('SELECT id, data FROM servers'):
+            servers[row['id']] = json.loads(row['data'])
+            self.server_texts[row['id']] = row['data']
+        return servers
+
+    def save_servers(self, servers):
+        with self.lock:
+            conn = self.connect()
+            for server_id, server in servers.items():
+                text = json.dumps(server, ensure_ascii=False)
+                if self.server_texts.get(server_id) == text:
+                    continue
+                conn.execute(
+                    'INSERT OR REPLACE INTO servers (id, name, java_path, data) VALUES (?, ?, ?, ?)',
+                    (server_id, server.get('name'), server.get('java_path'), text)
+                )
+                self.server_texts[server_id] = text
+            for server_id in set(self.server_texts) - set(servers):
+                conn.execute('DELETE FROM servers WHERE id = ?', (server_id,))
+                del self.server_texts[server_id]
+            conn.commit()
+
+    def servers_using_java(self, java_path):
+        return [row['name'] for row in self.query('SELECT name FROM servers WHERE java_path = ?', (java_path,))]
+
+    # 定时任务
+    def load_tasks(self):
+        return {row['id']: json.loads(row['data']) for row in self.query('SELECT id, data FROM tasks')}
+
+    def save_task(self, task_id, task):
+        self.execute(
+            'INSERT OR REPLACE INTO tasks (id, server_id, type, data) VALUES (?, ?, ?, ?)',
+            (task_id, task.get('server_id'), task.get('type'), json.dumps(task, ensure_ascii=False))
+        )
+
+    def delete_task(self, task_id):
+        self.execute('DELETE FROM tasks WHERE id = ?', (task_id,))
+
+    # 命令历史
+    def add_command(self, server_id, command, timestamp):
+        with self.lock:
+            conn = self.connect()
+            conn.execute(
+                'INSERT INTO command_history (server_id, command, timestamp) VALUES (?, ?, ?)',
+                (server_id, command, timestamp)
+            )
+            # 每个服务器只保留最近的记录
+            conn.execute(
+                'DELETE FROM command_history WHERE server_id = ? AND id <= '
+                '(SELECT id FROM command_history WHERE server_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)',
+                (server_id, server_id, COMMAND_HISTORY_LIMIT)
+            )
+            conn.commit()
+
+    def command_history(self, server_id):
+        rows = self.query(
+            'SELECT command, timestamp FROM command_history WHERE server_id = ? ORDER BY id DESC LIMIT ?',
+            (server_id, COMMAND_HISTORY_LIMIT)
+        )
+        return rows[::-1]
+
+    # 玩家会话
+    def open_session(self, server_id, player, joined_at):
+        self.execute(
+            'INSERT INTO player_sessions (server_id, player, joined_at) VALUES (?, ?, ?)',
+            (server_id, player, joined_at)
+        )
+
+    def close_session(self, server_id, player, left_at):
+        self.execute(
+            'UPDATE player_sessions SET left_at = ? WHERE server_id = ? AND player = ? AND left_at IS NULL',
+            (left_at, server_id, player)
+        )
+
+    def close_all_sessions(self, server_id=None, left_at=None):
+        left_at = left_at or time.time()
+        if server_id is None:
+            self.execute('UPDATE player_sessions SET left_at = ? WHERE left_at IS NULL', (left_at,))
+        else:
+            self.execute('UPDATE player_sessions SET left_at = ? WHERE server_id = ? AND left_at IS NULL',
+                         (left_at, server_id))
+
+    def player_sessions(self, server_id, limit=100):
+        return self.query(
+            'SELECT player, joined_at, left_at FROM player_sessions WHERE server_id = ? '
+            'ORDER BY joined_at DESC LIMIT ?',
+            (server_id, limit)
+        )
+
+    # 崩溃记录
+    def add_crash(self, server_id, exit_code, crash_report, log_file, crashed_at):
+        with self.lock:
+            conn = self.connect()
+            conn.execute(
+                'INSERT INTO server_crashes (server_id, exit_code, crash_report, log_file, crashed_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (server_id, exit_code, crash_report, log_file, crashed_at)
+            )
+            # 每个服务器只保留最近的记录，另存的崩溃日志一起删除
+            expired = conn.execute(
+                'SELECT id, log_file FROM server_crashes WHERE server_id = ? ORDER BY id DESC LIMIT -1 OFFSET ?',
+                (server_id, CRASH_HISTORY_LIMIT)
+            ).fetchall()
+            conn.executemany('DELETE FROM server_crashes WHERE id = ?', [(row['id'],) for row in expired])
+            conn.commit()
+        for row in expired:
+            if row['log_file'] and os.path.exists(row['log_file']):
+                try:
+                    os.remove(row['log_file'])
+                except OSError as e:
+                    print(f"删除崩溃日志失败: {str(e)}")
+
+    def crashes(self, server_id, limit=50):
+        return self.query(
+            'SELECT exit_code, crash_report, log_file, crashed_at FROM server_crashes WHERE server_id = ? '
+            'ORDER BY crashed_at DESC LIMIT ?',
+            (server_id, limit)
+        )
+
+    # 后台任务
+    def save_job(self, job):
+        data = job.to_dict()
+        self.execute(
+            'INSERT OR REPLACE INTO jobs (id, type, server_id, status, description, progress, message, '
+            'error, result, created_at, started_at, finished_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (data['id'], data['type'], data['server_id'], data['status'], data['description'],
+             data['progress'], data['message'], data['error'],
+             json.dumps(data['result'], ensure_ascii=False, default=str), data['created_at'],
+             data['started_at'], data['finished_at'])
+        )
+
+    def get_job(self, job_id):
+        rows = self.query('SELECT * FROM jobs WHERE id = ?', (job_id,))
+        if not rows:
+            return None
+        job = rows[0]
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def mark_interrupted_jobs(self):
+        """面板重启前未完成的任务标记为中断"""
+        self.execute(
+            "UPDATE jobs SET status = 'interrupted', message = '面板重启，任务中断', finished_at = ? "
+            "WHERE status IN ('queued', 'running')",
+            (time.time(),)
+        )
+
+state_store = StateStore(STATE_DB_FILE)
+
+def dump_config(data):
+    """序列化面板设置，服务器列表保存在状态库中"""
+    return json.dumps({key: value for key, value in data.items() if key != 'servers'}, indent=4, ensure_ascii=False)
+
+def write_config_file(text):
+    """原子写入配置文件，写入过程中崩溃也不会留下半个文件"""
+    os.makedirs(os.path.dirname(CONFIG_PATH), exist_ok=True)
+    temp_path = CONFIG_PATH + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, CONFIG_PATH)
 
 def load_config():
     """加载或创建配置文件"""
+    global config_saved_text
     default_config = {
         "web_port": 5000,
         "security": {
@@ -156,14 +708,18 @@ def load_config():
                 "description": "设置天气"
             }
         },
+        "log_translations": {},
+        "use_x_sendfile": False,
+        "download_workers": 3,
+        "auto_restart": dict(DEFAULT_AUTO_RESTART),
         "servers": {}
     }
 
-    config_path = 'config/config.json'
-    if os.path.exists(config_path):
+    if os.path.exists(CONFIG_PATH):
         try:
-            with open(config_path, 'r', encoding='utf-8') as f:
+            with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
                 config = json.load(f)
+            original = json.loads(json.dumps(config))
             # 确保所有必需的配置项都存在
             for key, value in default_config.items():
                 if key not in config:
@@ -171,105 +727,706 @@ def load_config():
             # 特别确保 security 部分存在
             if 'security' not in config:
                 config['security'] = default_config['security']
-            # 保存更新后的配置
-            os.makedirs('config', exist_ok=True)
-            with open(config_path, 'w', encoding='utf-8') as f:
-                json.dump(config, f, indent=4, ensure_ascii=False)
+            # 服务器列表保存在状态库中，旧版配置文件里的服务器迁移过去
+            servers = state_store.load_servers()
+            if not servers and config['servers']:
+                state_store.save_servers(config['servers'])
+                servers = config['servers']
+                print(f"已将 {len(servers)} 个服务器迁移到状态库")
+            config['servers'] = servers
+            # 只有补充了配置项或迁移了服务器时才写回
+            text = dump_config(config)
+            if 'servers' in original or any(key not in original for key in config if key != 'servers'):
+                write_config_file(text)
+            config_saved_text = text
             return config
         except Exception as e:
             print(f"加载配置文件失败: {str(e)}")
             return default_config
     else:
         # 创建新的配置文件
-        os.makedirs('config', exist_ok=True)
-        with open(config_path, 'w', encoding='utf-8') as f:
-            json.dump(default_config, f, indent=4, ensure_ascii=False)
+        default_config['servers'] = state_store.load_servers()
+        config_saved_text = dump_config(default_config)
+        write_config_file(config_saved_text)
         return default_config
 
+def flush_config():
+    """立即把配置写入磁盘，内容没有变化时跳过；失败时稍后重试，修改不会丢失"""
+    global config_save_timer, config_saved_text
+    with config_lock:
+        if config_save_timer is not None:
+            config_save_timer.cancel()
+            config_save_timer = None
+        try:
+            text = dump_config(config)
+            if text != config_saved_text:
+                write_config_file(text)
+                config_saved_text = text
+        except Exception as e:
+            print(f"保存配置文件失败，稍后重试: {str(e)}")
+            schedule_config_flush()
+
+def schedule_config_flush():
+    """CONFIG_SAVE_DELAY秒后写入配置，已有等待中的写入时不重复安排"""
+    global config_save_timer
+    with config_lock:
+        if config_save_timer is None:
+            config_save_timer = threading.Timer(CONFIG_SAVE_DELAY, flush_config)
+            config_save_timer.daemon = True
+            config_save_timer.start()
+
 def save_config():
-    os.makedirs('config', exist_ok=True)
-    with open('config/config.json', 'w', encoding='utf-8') as f:
-        json.dump(config, f, indent=4, ensure_ascii=False)
+    """登记一次配置修改
 
-# 下载线程函数
-def download_thread():
-    while True:
-        task = download_queue.get()
-        if task is None:
-            break
-            
-        server_id, name, mc_version, core_version = task
-        download_status[server_id] = {
-            "status": "downloading",
-            "progress": 0,
-            "message": "正在获取下载信息..."
+    服务器的变化立即写入状态库（只更新改动的行），面板设置在CONFIG_SAVE_DELAY秒内合并为一次写入。
+    """
+    with config_lock:
+        try:
+            state_store.save_servers(config['servers'])
+        except Exception as e:
+            print(f"保存服务器配置失败: {str(e)}")
+        schedule_config_flush()
+
+@atexit.register
+def flush_pending_config():
+    """退出前写入尚未保存的修改，与最近一次写入的内容比较，不依赖定时器状态"""
+    global config_save_timer
+    if config is None:
+        return
+    with config_lock:
+        if config_save_timer is not None:
+            config_save_timer.cancel()
+            config_save_timer = None
+        try:
+            text = dump_config(config)
+            if text != config_saved_text:
+                write_config_file(text)
+        except Exception as e:
+            print(f"保存配置文件失败: {str(e)}")
+
+# 后台任务：每类任务一个有界线程池，同一服务器的任务按提交顺序依次执行
+JOB_POOLS = {
+    'backup': 2,
+    'download': 3,
+    'io': 2,
+    'command': 2,
+    'restart': 2
+}
+# 重启时停止和再次启动之间的间隔
+RESTART_DELAY = 5
+JOB_HISTORY_LIMIT = 200
+
+# 外部HTTP请求共用一个带连接池的会话，超时和重试统一配置
+HTTP_TIMEOUT = (10, 60)  # (连接, 读取)
+HTTP_POOL_SIZE = 16
+DOWNLOAD_RETRIES = 3
+DOWNLOAD_RETRY_BACKOFF = 2
+# 下载块大小在两者之间自适应，目标是每次读取约0.25秒
+DOWNLOAD_MIN_CHUNK = 64 * 1024
+DOWNLOAD_MAX_CHUNK = 4 * 1024 * 1024
+DOWNLOAD_CHUNK_TARGET_SECONDS = 0.25
+DOWNLOAD_PROGRESS_INTERVAL = 0.5
+# 镜像支持Range时分段并行下载，进度记录在<临时文件>.json中用于续传
+DOWNLOAD_SEGMENTS = 4
+DOWNLOAD_MIN_SEGMENT = 4 * 1024 * 1024
+# 核心jar缓存：按sha1存放，所有服务器共用，链接到服务器目录
+JAR_CACHE_DIR = os.path.join('cache', 'jars')
+JAR_CACHE_INDEX = os.path.join(JAR_CACHE_DIR, 'index.json')
+# 没有服务器引用的jar至少保留这么久，方便删除后马上重建同版本的服务器
+JAR_CACHE_GRACE = 24 * 3600
+jar_cache_lock = threading.Lock()
+jar_download_locks = {}
+
+class JobCancelled(Exception):
+    """任务已被取消"""
+
+class Job:
+    """后台任务，任务函数通过update报告进度，同时在这里响应取消"""
+    def __init__(self, job_type, server_id, description, func, pool):
+        self.id = str(uuid.uuid4())
+        self.type = job_type
+        self.server_id = server_id
+        self.description = description
+        self.func = func
+        self.pool = pool
+        self.status = 'queued'
+        self.progress = 0
+        self.message = '等待执行'
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.exclusive = False
+        self.cancel_event = threading.Event()
+
+    def update(self, progress=None, message=None):
+        """更新进度；任务已被取消时抛出JobCancelled"""
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+        if progress is not None:
+            self.progress = min(100, max(0, round(progress, 1)))
+        if message is not None:
+            self.message = message
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "type": self.type,
+            "server_id": self.server_id,
+            "description": self.description,
+            "status": self.status,
+            "progress": self.progress,
+            "message": self.message,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
         }
-        
+
+class JobManager:
+    def __init__(self, pools):
+        self.executors = {
+            name: ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"job-{name}")
+            for name, workers in pools.items()
+        }
+        self.lock = threading.Lock()
+        self.jobs = OrderedDict()
+        # 每个服务器同一时间只运行一个任务，其余在这里排队
+        self.server_queues = {}
+        self.busy_servers = set()
+
+    def record(self, job):
+        """把任务状态写入状态库，失败不影响任务本身"""
         try:
-            # 获取下载信息
-            response = requests.get(f"{MIRROR_API_BASE}/{name}/{mc_version}/{core_version}")
-            if not response.ok:
-                raise Exception("获取下载信息失败")
-            
-            download_info = response.json()
-            if not download_info.get("success"):
-                raise Exception(download_info.get("message", "获取下载信息失败"))
-            
-            # 下载文件
-            download_url = download_info["data"]["download_url"]
-            response = requests.get(download_url, stream=True)
-            if not response.ok:
-                raise Exception("下载文件失败")
-            
-            # 获取文件大小
-            total_size = int(response.headers.get('content-length', 0))
-            
-            server = config["servers"][server_id]
-            file_path = os.path.join(server["server_path"], download_info["data"]["filename"])
-            
-            # 创建临时文件
-            temp_path = file_path + ".tmp"
-            downloaded_size = 0
-            
-            with open(temp_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-                        downloaded_size += len(chunk)
-                        if total_size:
-                            progress = (downloaded_size / total_size) * 100
-                            download_status[server_id]["progress"] = progress
-                            download_status[server_id]["message"] = f"下载中... {progress:.1f}%"
-            
-            # 下载完成，移动文件
-            os.replace(temp_path, file_path)
-            
-            # 更新服务器配置
-            config["servers"][server_id]["server_jar"] = download_info["data"]["filename"]
+            state_store.save_job(job)
+        except Exception as e:
+            print(f"保存任务记录失败: {str(e)}")
+
+    def submit(self, job_type, server_id, func, description='', pool=None, exclusive=True):
+        """提交任务；exclusive为False时不参与同一服务器的排队"""
+        job = Job(job_type, server_id, description, func, pool or job_type)
+        job.exclusive = exclusive and server_id is not None
+        self.record(job)
+        with self.lock:
+            self.jobs[job.id] = job
+            self._trim()
+            if not job.exclusive:
+                self._dispatch(job)
+            elif server_id in self.busy_servers:
+                self.server_queues.setdefault(server_id, deque()).append(job)
+            else:
+                self.busy_servers.add(server_id)
+                self._dispatch(job)
+        return job
+
+    def _dispatch(self, job):
+        self.executors[job.pool].submit(self._run, job)
+
+    def _run(self, job):
+        try:
+            if job.status == 'cancelled':
+                return
+            job.status = 'running'
+            job.started_at = time.time()
+            job.message = '执行中'
+            self.record(job)
+            job.result = job.func(job)
+            job.progress = 100
+            job.status = 'completed'
+            job.message = '已完成'
+        except JobCancelled:
+            job.status = 'cancelled'
+            job.message = '已取消'
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e)
+            job.message = f"执行失败: {str(e)}"
+        finally:
+            job.finished_at = job.finished_at or time.time()
+            self.record(job)
+            if job.exclusive:
+                self._next(job.server_id)
+
+    def _next(self, server_id):
+        """启动该服务器排队中的下一个任务"""
+        if server_id is None:
+            return
+        with self.lock:
+            queue = self.server_queues.get(server_id)
+            while queue:
+                job = queue.popleft()
+                if job.status != 'cancelled':
+                    self._dispatch(job)
+                    return
+            self.server_queues.pop(server_id, None)
+            self.busy_servers.discard(server_id)
+
+    def configure_pool(self, pool, workers):
+        """调整线程池大小，已提交的任务在旧线程池中继续执行"""
+        with self.lock:
+            old = self.executors.get(pool)
+            self.executors[pool] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"job-{pool}")
+        if old:
+            old.shutdown(wait=False)
+
+    def _trim(self):
+        """只保留最近的已结束任务"""
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished_at]
+        for job_id in finished[:max(0, len(self.jobs) - JOB_HISTORY_LIMIT)]:
+            del self.jobs[job_id]
+
+    def cancel(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.finished_at:
+                return False
+            job.cancel_event.set()
+            if job.status == 'queued':
+                job.status = 'cancelled'
+                job.message = '已取消'
+                job.finished_at = time.time()
+                self.record(job)
+            return True
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def list(self, server_id=None, job_type=None, status=None):
+        with self.lock:
+            jobs = list(self.jobs.values())
+        return [job for job in jobs
+                if (server_id is None or job.server_id == server_id)
+                and (job_type is None or job.type == job_type)
+                and (status is None or job.status == status)]
+
+job_manager = JobManager(JOB_POOLS)
+
+def create_http_session():
+    """创建带连接池和自动重试的会话，连接和5xx错误按指数退避重试"""
+    http_session = requests.Session()
+    retry = Retry(
+        total=DOWNLOAD_RETRIES,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=('GET', 'HEAD')
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+    http_session.mount('http://', adapter)
+    http_session.mount('https://', adapter)
+    http_session.headers['User-Agent'] = 'EMS3'
+    return http_session
+
+http_session = create_http_session()
+
+def adapt_chunk_size(chunk_size, elapsed):
+    """根据本次读取耗时调整块大小"""
+    if elapsed < DOWNLOAD_CHUNK_TARGET_SECONDS / 2:
+        return min(chunk_size * 2, DOWNLOAD_MAX_CHUNK)
+    if elapsed > DOWNLOAD_CHUNK_TARGET_SECONDS * 2:
+        return max(chunk_size // 2, DOWNLOAD_MIN_CHUNK)
+    return chunk_size
+
+def stream_to_file(job, response, temp_path, report):
+    """把响应写入文件，块大小随速度自适应，进度按固定间隔报告"""
+    total_size = int(response.headers.get('content-length', 0))
+    chunk_size = DOWNLOAD_MIN_CHUNK
+    downloaded_size = 0
+    started = time.time()
+    last_report = 0
+    with open(temp_path, 'wb') as f:
+        while True:
+            read_started = time.time()
+            data = response.raw.read(chunk_size, decode_content=True)
+            if not data:
+                break
+            f.write(data)
+            downloaded_size += len(data)
+            chunk_size = adapt_chunk_size(chunk_size, time.time() - read_started)
+            now = time.time()
+            if now - last_report < DOWNLOAD_PROGRESS_INTERVAL:
+                # 不报告进度时也要响应取消
+                job.update()
+                continue
+            last_report = now
+            speed = downloaded_size / (1024 * 1024) / max(now - started, 0.001)
+            if total_size:
+                progress = downloaded_size / total_size * 100
+                report(progress, f"下载中... {progress:.1f}% ({speed:.2f} MB/s)")
+            else:
+                report(None, f"下载中... {downloaded_size / (1024 * 1024):.1f} MB ({speed:.2f} MB/s)")
+    if total_size and downloaded_size < total_size:
+        raise requests.exceptions.ChunkedEncodingError(f"连接提前关闭 ({downloaded_size}/{total_size})")
+    return downloaded_size
+
+def download_file_with_retry(job, url, temp_path, report):
+    """下载到temp_path，传输中断时按指数退避重新下载"""
+    for attempt in range(DOWNLOAD_RETRIES + 1):
+        try:
+            with http_session.get(url, stream=True, timeout=HTTP_TIMEOUT) as response:
+                if not response.ok:
+                    raise Exception(f"下载文件失败: HTTP {response.status_code}")
+                return stream_to_file(job, response, temp_path, report)
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            if attempt == DOWNLOAD_RETRIES:
+                raise Exception(f"下载文件失败: {str(e)}")
+            delay = DOWNLOAD_RETRY_BACKOFF ** attempt
+            report(0, f"连接中断，{delay}秒后重试 ({attempt + 1}/{DOWNLOAD_RETRIES})")
+            time.sleep(delay)
+
+class DownloadSourceChanged(Exception):
+    """续传时发现镜像上的文件已变化"""
+
+def plan_download_segments(total_size):
+    count = max(1, min(DOWNLOAD_SEGMENTS, total_size // DOWNLOAD_MIN_SEGMENT))
+    size = -(-total_size // count)
+    return [
+        {'start': start, 'end': min(total_size, start + size) - 1, 'done': 0}
+        for start in range(0, total_size, size)
+    ]
+
+def load_download_journal(journal_path, temp_path, url, total_size, validator):
+    """读取续传记录，和当前下载不符时返回None"""
+    try:
+        with open(journal_path, 'r', encoding='utf-8') as f:
+            journal = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if journal.get('url') != url or journal.get('size') != total_size or \
+       journal.get('validator') != validator or \
+       not os.path.exists(temp_path) or os.path.getsize(temp_path) != total_size:
+        return None
+    return journal
+
+def save_download_journal(journal_path, journal):
+    temp = journal_path + '.tmp'
+    with open(temp, 'w', encoding='utf-8') as f:
+        json.dump(journal, f)
+    os.replace(temp, journal_path)
+
+def remove_download_files(temp_path):
+    for path in (temp_path, temp_path + '.json'):
+        if os.path.exists(path):
+            os.remove(path)
+
+def download_segment(url, temp_path, segment, validator, stop_event):
+    """下载一个分段，连接中断时从已写入的位置重试"""
+    for attempt in range(DOWNLOAD_RETRIES + 1):
+        position = segment['start'] + segment['done']
+        if position > segment['end'] or stop_event.is_set():
+            return
+        headers = {'Range': f"bytes={position}-{segment['end']}", 'Accept-Encoding': 'identity'}
+        if validator:
+            headers['If-Range'] = validator
+        try:
+            with http_session.get(url, headers=headers, stream=True, timeout=HTTP_TIMEOUT) as response:
+                if response.status_code == 200:
+                    raise DownloadSourceChanged()
+                if response.status_code != 206:
+                    raise Exception(f"下载文件失败: HTTP {response.status_code}")
+                chunk_size = DOWNLOAD_MIN_CHUNK
+                # 不经过缓冲直接写入，done和文件中的数据保持一致，面板崩溃后也能续传
+                with open(temp_path, 'r+b', buffering=0) as f:
+                    f.seek(position)
+                    while position <= segment['end']:
+                        if stop_event.is_set():
+                            return
+                        read_started = time.time()
+                        data = response.raw.read(min(chunk_size, segment['end'] - position + 1))
+                        if not data:
+                            raise requests.exceptions.ChunkedEncodingError("连接提前关闭")
+                        f.write(data)
+                        position += len(data)
+                        segment['done'] += len(data)
+                        chunk_size = adapt_chunk_size(chunk_size, time.time() - read_started)
+                return
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            if attempt == DOWNLOAD_RETRIES:
+                raise Exception(f"下载文件失败: {str(e)}")
+            stop_event.wait(DOWNLOAD_RETRY_BACKOFF ** attempt)
+
+def download_segmented(job, url, temp_path, report):
+    """镜像支持Range时分段并行下载，返回False表示不支持，由调用方改用单连接下载
+
+    进度写在temp_path.json中，中断后（包括面板重启）再次下载同一文件时从断点继续。
+    """
+    journal_path = temp_path + '.json'
+    with http_session.head(url, allow_redirects=True, timeout=HTTP_TIMEOUT) as response:
+        if not response.ok or response.headers.get('Accept-Ranges', '').lower() != 'bytes':
+            return False
+        total_size = int(response.headers.get('Content-Length', 0))
+        etag = response.headers.get('ETag', '')
+        # 弱ETag不能用于If-Range，改用Last-Modified
+        validator = etag if etag and not etag.startswith('W/') else response.headers.get('Last-Modified')
+    if not total_size:
+        return False
+    
+    journal = load_download_journal(journal_path, temp_path, url, total_size, validator)
+    if journal is None:
+        journal = {'url': url, 'size': total_size, 'validator': validator,
+                   'segments': plan_download_segments(total_size)}
+        with open(temp_path, 'wb') as f:
+            f.truncate(total_size)
+        save_download_journal(journal_path, journal)
+    
+    segments = journal['segments']
+    resumed = sum(segment['done'] for segment in segments)
+    pending_segments = [segment for segment in segments if segment['start'] + segment['done'] <= segment['end']]
+    started = time.time()
+    stop_event = threading.Event()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, len(pending_segments))) as pool:
+            futures = [pool.submit(download_segment, url, temp_path, segment, validator, stop_event)
+                       for segment in pending_segments]
+            try:
+                while True:
+                    finished, pending = wait(futures, timeout=DOWNLOAD_PROGRESS_INTERVAL)
+                    for future in finished:
+                        future.result()
+                    save_download_journal(journal_path, journal)
+                    downloaded = sum(segment['done'] for segment in segments)
+                    progress = downloaded / total_size * 100
+                    speed = (downloaded - resumed) / (1024 * 1024) / max(time.time() - started, 0.001)
+                    report(progress, f"下载中... {progress:.1f}% ({speed:.2f} MB/s，{len(pending_segments)} 个连接)")
+                    if not pending:
+                        break
+            except BaseException:
+                stop_event.set()
+                raise
+    except DownloadSourceChanged:
+        remove_download_files(temp_path)
+        raise Exception("镜像上的文件已变化，请重新下载")
+    finally:
+        if os.path.exists(journal_path):
+            save_download_journal(journal_path, journal)
+    return True
+
+def jar_cache_key(name, mc_version, core_version):
+    return f"{name}/{mc_version}/{core_version}"
+
+def load_jar_cache_index():
+    try:
+        with open(JAR_CACHE_INDEX, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_jar_cache_index(index):
+    os.makedirs(JAR_CACHE_DIR, exist_ok=True)
+    temp = JAR_CACHE_INDEX + '.tmp'
+    with open(temp, 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=4, ensure_ascii=False)
+    os.replace(temp, JAR_CACHE_INDEX)
+
+def jar_cache_path(sha1):
+    return os.path.join(JAR_CACHE_DIR, f"{sha1}.jar")
+
+def lookup_jar_cache(key, sha1=None):
+    """查找已缓存的jar，返回sha1；镜像给出的sha1与缓存不一致时视为未缓存"""
+    with jar_cache_lock:
+        entry = load_jar_cache_index().get(key)
+    if not entry or (sha1 and entry['sha1'] != sha1.lower()):
+        return None
+    if not os.path.exists(jar_cache_path(entry['sha1'])):
+        return None
+    return entry['sha1']
+
+def add_jar_cache(key, temp_path, filename):
+    """把下载好的文件放入缓存，返回sha1"""
+    sha1 = hash_file(temp_path, 'sha1')
+    os.replace(temp_path, jar_cache_path(sha1))
+    with jar_cache_lock:
+        index = load_jar_cache_index()
+        index[key] = {
+            'sha1': sha1,
+            'filename': filename,
+            'size': os.path.getsize(jar_cache_path(sha1)),
+            'last_used': time.time()
+        }
+        save_jar_cache_index(index)
+    return sha1
+
+def link_cached_jar(sha1, target):
+    """把缓存的jar放到服务器目录：优先硬链接，跨文件系统时用reflink或复制"""
+    source = jar_cache_path(sha1)
+    temp = target + '.tmp'
+    if os.path.exists(temp):
+        os.remove(temp)
+    try:
+        os.link(source, temp)
+    except OSError:
+        clone_file(source, temp)
+    os.replace(temp, target)
+    with jar_cache_lock:
+        index = load_jar_cache_index()
+        for entry in index.values():
+            if entry['sha1'] == sha1:
+                entry['last_used'] = time.time()
+        save_jar_cache_index(index)
+
+def break_hardlink(path):
+    """文件与其他路径共用inode（如缓存的jar）时先删除，避免原地写入改动到共享的内容"""
+    if os.path.isfile(path) and os.stat(path).st_nlink > 1:
+        os.remove(path)
+
+def collect_jar_cache():
+    """删除没有服务器引用且超过保留期的缓存jar"""
+    referenced = {server.get('core_sha1') for server in config["servers"].values()}
+    now = time.time()
+    removed = 0
+    with jar_cache_lock:
+        index = load_jar_cache_index()
+        for key, entry in list(index.items()):
+            if entry['sha1'] in referenced or now - entry.get('last_used', 0) < JAR_CACHE_GRACE:
+                continue
+            del index[key]
+            if not any(other['sha1'] == entry['sha1'] for other in index.values()):
+                path = jar_cache_path(entry['sha1'])
+                if os.path.exists(path):
+                    os.remove(path)
+                    removed += 1
+        save_jar_cache_index(index)
+    return removed
+
+def run_core_download(job, server_id, name, mc_version, core_version):
+    """下载服务器核心（在download线程池中执行）
+
+    核心先下载到共享缓存，再链接到服务器目录；已缓存时不再下载。
+    """
+    download_status[server_id] = {
+        "status": "downloading",
+        "progress": 0,
+        "message": "正在获取下载信息..."
+    }
+    temp_path = None
+    
+    try:
+        # 获取下载信息（download_core刚请求过，通常直接命中缓存）
+        download_info = get_build_info(name, mc_version, core_version)
+        
+        server = config["servers"][server_id]
+        filename = download_info["filename"]
+        file_path = os.path.join(server["server_path"], filename)
+        expected_sha1 = download_info.get("sha1")
+        key = jar_cache_key(name, mc_version, core_version)
+        
+        def report(progress, message):
+            if progress is not None:
+                download_status[server_id]["progress"] = progress
+            download_status[server_id]["message"] = message
+            job.update(progress, message)
+        
+        # 同一个核心同时只下载一次，其他服务器等待后直接使用缓存
+        with jar_cache_lock:
+            download_lock = jar_download_locks.setdefault(key, threading.Lock())
+        with download_lock:
+            sha1 = lookup_jar_cache(key, expected_sha1)
+            if sha1 is None:
+                os.makedirs(JAR_CACHE_DIR, exist_ok=True)
+                # 临时文件名由核心版本决定，面板重启后仍能续传
+                temp_path = os.path.join(JAR_CACHE_DIR, hashlib.sha1(key.encode()).hexdigest() + '.download')
+                download_url = download_info["download_url"]
+                if not download_segmented(job, download_url, temp_path, report):
+                    download_file_with_retry(job, download_url, temp_path, report)
+                
+                # 校验镜像提供的sha1
+                if expected_sha1:
+                    report(100, "正在校验文件...")
+                    if hash_file(temp_path, 'sha1') != expected_sha1.lower():
+                        remove_download_files(temp_path)
+                        raise Exception("文件校验失败（sha1不匹配），请重新下载")
+                
+                sha1 = add_jar_cache(key, temp_path, filename)
+                remove_download_files(temp_path)
+            else:
+                report(100, "使用已缓存的核心")
+        
+        link_cached_jar(sha1, file_path)
+        
+        # 更新服务器配置
+        with config_lock:
+            config["servers"][server_id]["server_jar"] = filename
             config["servers"][server_id]["type"] = name
+            config["servers"][server_id]["core_sha1"] = sha1
             save_config()
-            
-            download_status[server_id] = {
-                "status": "completed",
-                "progress": 100,
-                "message": "下载完成"
-            }
-            
-        except Exception as e:
-            download_status[server_id] = {
-                "status": "error",
-                "progress": 0,
-                "message": str(e)
-            }
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
+        collect_jar_cache()
         
-        download_queue.task_done()
+        download_status[server_id] = {
+            "status": "completed",
+            "progress": 100,
+            "message": "下载完成"
+        }
+        return {"filename": filename}
+        
+    except Exception as e:
+        download_status[server_id] = {
+            "status": "error",
+            "progress": 0,
+            "message": "下载已取消" if isinstance(e, JobCancelled) else str(e)
+        }
+        # 有续传记录时保留临时文件，下次从断点继续；取消则全部删除
+        if temp_path and (isinstance(e, JobCancelled) or not os.path.exists(temp_path + '.json')):
+            remove_download_files(temp_path)
+        raise
 
-# 启动下载线程
-download_thread = threading.Thread(target=download_thread)
-download_thread.daemon = True
-download_thread.start()
+def remove_path_job(job, full_path):
+    """逐个删除目录中的文件，可报告进度和取消"""
+    removed = 0
+    for root, dirs, files in os.walk(full_path, topdown=False):
+        for name in files:
+            os.remove(os.path.join(root, name))
+            removed += 1
+            if removed % 200 == 0:
+                job.update(message=f"已删除 {removed} 个文件")
+        for name in dirs:
+            dir_path = os.path.join(root, name)
+            if os.path.islink(dir_path):
+                os.remove(dir_path)
+            else:
+                os.rmdir(dir_path)
+    os.rmdir(full_path)
+    return {"removed_files": removed}
+
+def is_within_directory(directory, target):
+    directory = os.path.abspath(directory)
+    target = os.path.abspath(target)
+    return os.path.commonpath([directory, target]) == directory
+
+def extract_archive_job(job, archive_path, target_dir):
+    """解压zip或tar压缩包，拒绝解压到目标目录之外的成员
+
+    解压会原地覆盖已有文件，覆盖前先断开与jar缓存共用的硬链接。
+    """
+    os.makedirs(target_dir, exist_ok=True)
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            members = archive.infolist()
+            total = sum(member.file_size for member in members) or 1
+            done = 0
+            for member in members:
+                if not is_within_directory(target_dir, os.path.join(target_dir, member.filename)):
+                    raise Exception(f"压缩包包含非法路径: {member.filename}")
+                break_hardlink(os.path.join(target_dir, member.filename))
+                archive.extract(member, target_dir)
+                done += member.file_size
+                job.update(done / total * 100, f"正在解压 {member.filename}")
+            return {"files": len(members)}
+    if tarfile.is_tarfile(archive_path):
+        with tarfile.open(archive_path) as archive:
+            members = archive.getmembers()
+            total = sum(member.size for member in members) or 1
+            done = 0
+            for member in members:
+                if not is_within_directory(target_dir, os.path.join(target_dir, member.name)) or \
+                   member.issym() or member.islnk() or member.isdev():
+                    raise Exception(f"压缩包包含非法成员: {member.name}")
+                break_hardlink(os.path.join(target_dir, member.name))
+                archive.extract(member, target_dir)
+                done += member.size
+                job.update(done / total * 100, f"正在解压 {member.name}")
+            return {"files": len(members)}
+    raise Exception("不支持的压缩包格式")
 
 # 登录装饰器
 def login_required(f):
@@ -282,6 +1439,43 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+class Histogram:
+    """按标签分组的累积直方图，用于导出Prometheus指标"""
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def observe(self, labels, value):
+        with self.lock:
+            data = self.series.get(labels)
+            if data is None:
+                data = self.series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[0][i] += 1
+            data[1] += value
+            data[2] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {labels: (list(counts), total, count) for labels, (counts, total, count) in self.series.items()}
+
+http_request_latency = Histogram(HTTP_LATENCY_BUCKETS)
+
+@app.before_request
+def start_request_timer():
+    request.start_time = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    start_time = getattr(request, 'start_time', None)
+    if start_time is not None:
+        # 使用路由规则而不是实际路径，避免标签数量随服务器ID增长
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        http_request_latency.observe((request.method, endpoint), time.perf_counter() - start_time)
+    return response
+
 # 登录路由
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -313,6 +1507,7 @@ def get_servers():
         players = get_online_players(server_id)
         servers_data[server_id] = {
             **server,
+            "state": get_lifecycle(server_id).current(),
             "online_players": len(players),
             "players": players
         }
@@ -325,18 +1520,18 @@ def create_server():
     server_id = str(uuid.uuid4())
     server_path = os.path.join('servers', server_id)
     
-    config["servers"][server_id] = {
-        "name": data["name"],
-        "server_path": server_path,
-        "server_jar": data.get("server_jar", "server.jar"),
-        "java_path": data.get("java_path", "java"),
-        "java_args": data.get("java_args", "-Xmx1024M -Xms1024M"),
-        "server_port": data.get("server_port", 25565),
-        "type": data.get("type", "vanilla")
-    }
-    
     os.makedirs(server_path, exist_ok=True)
-    save_config()
+    with config_lock:
+        config["servers"][server_id] = {
+            "name": data["name"],
+            "server_path": server_path,
+            "server_jar": data.get("server_jar", "server.jar"),
+            "java_path": data.get("java_path", "java"),
+            "java_args": data.get("java_args", "-Xmx1024M -Xms1024M"),
+            "server_port": data.get("server_port", 25565),
+            "type": data.get("type", "vanilla")
+        }
+        save_config()
     return jsonify({"status": "success", "server_id": server_id})
 
 @app.route('/api/servers/<server_id>', methods=['DELETE'])
@@ -345,145 +1540,792 @@ def delete_server(server_id):
     if server_id in minecraft_processes:
         return jsonify({"status": "error", "message": "请先停止服务器"})
     
+    with server_lifecycles_lock:
+        lifecycle = server_lifecycles.pop(server_id, None)
+    if lifecycle is not None:
+        # 取消等待中的自动重启
+        lifecycle.stop()
     server = config["servers"].get(server_id)
     if server:
-        shutil.rmtree(server["server_path"], ignore_errors=True)
-        del config["servers"][server_id]
-        save_config()
-        return jsonify({"status": "success"})
+        server_path = server["server_path"]
+        remove_metric_store(server_id)
+        backup_catalog.remove_server(server_id)
+        with config_lock:
+            del config["servers"][server_id]
+            save_config()
+        collect_jar_cache()
+        # 服务器目录可能很大，在后台删除
+        job = None
+        if os.path.isdir(server_path):
+            job = job_manager.submit(
+                'delete', server_id, lambda job: remove_path_job(job, server_path),
+                f"删除服务器 {server['name']}", pool='io'
+            )
+        return jsonify({"status": "success", "job_id": job.id if job else None})
     return jsonify({"status": "error", "message": "服务器不存在"})
 
-@app.route('/api/start/<server_id>', methods=['POST'])
-@login_required
-def start_server(server_id):
-    if server_id not in config["servers"]:
-        return jsonify({"status": "error", "message": "服务器不存在"})
-    
-    if server_id in minecraft_processes and minecraft_processes[server_id].poll() is None:
-        return jsonify({"status": "error", "message": "服务器已在运行"})
-    
+def find_server_owner(server_path):
+    """返回仍在该服务器目录中运行的服务器进程PID，没有时返回None
+
+    不依赖本进程的minecraft_processes，其他面板进程启动的服务器也能发现。
+    """
+    try:
+        with open(os.path.join(server_path, SERVER_PID_FILE), 'r') as f:
+            pid = int(f.read().strip())
+        proc = psutil.Process(pid)
+        if proc.status() != psutil.STATUS_ZOMBIE and os.path.samefile(proc.cwd(), server_path):
+            return pid
+    except (OSError, ValueError, psutil.Error):
+        pass
+    return None
+
+def remove_server_pid_file(server_path, pid):
+    """服务器进程退出后删除PID文件，文件已被新进程覆盖时保留"""
+    pid_file = os.path.join(server_path, SERVER_PID_FILE)
+    try:
+        with open(pid_file, 'r') as f:
+            if f.read().strip() != str(pid):
+                return
+        os.remove(pid_file)
+    except (OSError, ValueError):
+        pass
+
+def launch_server_process(server_id):
+    """启动服务器进程并把输出重定向到日志文件
+
+    核心文件不存在或目录已被其他服务器进程占用时抛出异常。
+    """
     server = config["servers"][server_id]
     # 使用绝对路径
     server_path = os.path.abspath(server['server_path'])
     jar_path = os.path.abspath(os.path.join(server_path, server['server_jar']))
     
+    # 同一个存档和端口只能有一个服务器进程
+    owner = find_server_owner(server_path)
+    if owner is not None:
+        raise Exception(f"服务器目录正在被进程 {owner} 使用，请先停止该进程")
+    
     # 检查服务器核心文件是否存在
     if not os.path.exists(jar_path):
-        return jsonify({
-            "status": "error", 
-            "message": f"服务器核心文件不存在: {jar_path}\n请先下载服务器核心文件"
-        })
+        raise Exception(f"服务器核心文件不存在: {jar_path}\n请先下载服务器核心文件")
     
-    try:
-        # 创建日志目录
-        logs_dir = os.path.join(server_path, 'logs')
-        os.makedirs(logs_dir, exist_ok=True)
+    # 创建日志目录
+    logs_dir = os.path.join(server_path, 'logs')
+    os.makedirs(logs_dir, exist_ok=True)
+    
+    # 构建命令列表
+    java_args = server['java_args'].split()
+    cmd = [server['java_path']] + java_args + ['-jar', jar_path, 'nogui']
+    
+    # 启动进程并重定向输出到日志文件
+    log_file = os.path.join(logs_dir, 'latest.log')
+    log_generations[server_id] = log_generations.get(server_id, 0) + 1
+    with open(log_file, 'w', encoding='utf-8') as f:
+        # 使用CREATE_NO_WINDOW标志来隐藏控制台窗口（仅在Windows上有效）
+        startupinfo = None
+        if os.name == 'nt':
+            startupinfo = subprocess.STARTUPINFO()
+            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+            startupinfo.wShowWindow = subprocess.SW_HIDE
         
-        # 构建命令列表
-        java_args = server['java_args'].split()
-        cmd = [server['java_path']] + java_args + ['-jar', jar_path, 'nogui']
+        process = subprocess.Popen(
+            cmd,
+            cwd=server_path,
+            stdout=f,
+            stderr=f,
+            stdin=subprocess.PIPE,
+            text=True,
+            bufsize=1,  # 行缓冲，确保日志及时写入
+            startupinfo=startupinfo
+        )
+    with open(os.path.join(server_path, SERVER_PID_FILE), 'w') as f:
+        f.write(str(process.pid))
+    minecraft_processes[server_id] = process
+    return process, log_file
+
+def find_crash_report(server_path, since):
+    """返回since之后生成的最新崩溃报告路径"""
+    reports = glob.glob(os.path.join(server_path, 'crash-reports', '*.txt'))
+    reports = [path for path in reports if os.path.getmtime(path) >= since]
+    return max(reports, key=os.path.getmtime) if reports else None
+
+def save_crash_log(server_path):
+    """把崩溃时的latest.log另存为logs/crash-<时间>.log，下次启动会清空latest.log"""
+    log_file = os.path.join(server_path, 'logs', 'latest.log')
+    if not os.path.exists(log_file):
+        return None
+    crash_log = os.path.join(server_path, 'logs', f"crash-{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
+    try:
+        shutil.copy2(log_file, crash_log)
+        return crash_log
+    except OSError as e:
+        print(f"保存崩溃日志失败: {str(e)}")
+        return None
+
+def get_auto_restart_settings(server_id):
+    """合并面板的自动重启设置和服务器自己的开关"""
+    settings = dict(DEFAULT_AUTO_RESTART)
+    settings.update(config.get('auto_restart') or {})
+    server = config["servers"].get(server_id) or {}
+    settings['enabled'] = bool(settings['enabled'] and server.get('auto_restart', True))
+    return settings
+
+class ServerLifecycle:
+    """单个服务器的生命周期状态机，启动和停止在后台线程中完成
+
+    每个进程由一个监视线程阻塞等待退出，退出时立即更新状态，崩溃时按退避时间自动重启。
+    """
+    def __init__(self, server_id):
+        self.server_id = server_id
+        self.lock = threading.Lock()
+        self.state = 'stopped'
+        self.since = time.time()
+        self.message = ''
+        self.exit_code = None
+        self.crash_report = None
+        # 进入running之后进程退出视为崩溃，主动停止时除外
+        self.process = None
+        self.started_at = None
+        # 最近的崩溃时间，用于计算退避时间和判断崩溃循环
+        self.crash_times = deque()
+        self.restart_timer = None
+        self.restart_at = None
+
+    def _set(self, state, message=''):
+        self.state = state
+        self.since = time.time()
+        self.message = message
+
+    def current(self):
+        with self.lock:
+            return self.state
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "state": self.state,
+                "state_since": self.since,
+                "state_message": self.message,
+                "exit_code": self.exit_code,
+                "crash_report": self.crash_report,
+                "restart_at": self.restart_at
+            }
+
+    def start(self, wait=False, auto=False):
+        """开始启动服务器，返回(是否接受, 提示信息)；wait为True时等到启动完成
+
+        auto表示崩溃后的自动重启，手动启动会清空崩溃计数。
+        """
+        with self.lock:
+            if self.state in ('starting', 'running', 'stopping'):
+                return False, "服务器已在运行"
+            if auto and self.restart_at is None:
+                # 等待期间已被手动处理
+                return False, "自动重启已取消"
+            self._cancel_restart()
+            if not auto:
+                self.crash_times.clear()
+            try:
+                self.process, log_file = launch_server_process(self.server_id)
+            except Exception as e:
+                self._set('stopped', str(e))
+                return False, f"启动失败: {str(e)}"
+            process = self.process
+            self.started_at = time.time()
+            self.exit_code = None
+            self.crash_report = None
+            self._set('starting', "服务器正在启动中")
+        threading.Thread(target=self._watch, args=(process,), daemon=True).start()
+        if wait:
+            self._wait_ready(process, log_file)
+        else:
+            threading.Thread(target=self._wait_ready, args=(process, log_file), daemon=True).start()
+        return True, "服务器正在启动中"
+
+    def _wait_ready(self, process, log_file):
+        """等待日志中出现启动完成的标志，进程提前退出时由监视线程标记为crashed"""
+        cursor = 0
+        deadline = time.time() + SERVER_START_TIMEOUT
+        while time.time() < deadline:
+            if self.current() != 'starting' or self.process is not process:
+                return
+            result = read_log_since(log_file, cursor) if os.path.exists(log_file) else None
+            if result is not None:
+                lines, cursor = result
+                if any(SERVER_READY_PATTERN.search(LOG_PREFIX_PATTERN.match(line).group(2)) for line in lines):
+                    break
+            time.sleep(0.5)
+        with self.lock:
+            if self.state == 'starting' and self.process is process and process.poll() is None:
+                self._set('running', '' if time.time() < deadline else "未检测到启动完成的日志")
+
+    def stop(self, wait=False):
+        """开始停止服务器，返回(是否接受, 提示信息)；wait为True时等到进程退出"""
+        with self.lock:
+            # 等待自动重启时停止即取消重启
+            if self.restart_at is not None:
+                self._cancel_restart()
+                self._set('stopped', "已取消自动重启")
+                return True, "已取消自动重启"
+            process = minecraft_processes.get(self.server_id)
+            if self.state == 'stopping':
+                return False, "服务器正在停止"
+            if process is None or process.poll() is not None:
+                return False, "服务器未运行"
+            self.process = process
+            self._set('stopping', "正在保存并停止服务器")
+        if wait:
+            self._shutdown(process)
+        else:
+            threading.Thread(target=self._shutdown, args=(process,), daemon=True).start()
+        return True, "服务器正在停止"
+
+    def _shutdown(self, process):
+        """先发送stop命令让服务器保存世界，超时后依次terminate和kill"""
+        try:
+            process.stdin.write('stop\n')
+            process.stdin.flush()
+        except Exception as e:
+            print(f"发送stop命令失败: {str(e)}")
+        for escalate, timeout in ((None, SERVER_STOP_TIMEOUT), (process.terminate, SERVER_TERMINATE_TIMEOUT),
+                                  (process.kill, None)):
+            if escalate is not None:
+                print(f"服务器 {self.server_id} 未在规定时间内停止，强制结束")
+                escalate()
+            try:
+                process.wait(timeout=timeout)
+                break
+            except subprocess.TimeoutExpired:
+                continue
+        self._on_exit(process)
+
+    def _watch(self, process):
+        """监视线程：阻塞等待进程退出（waitpid），不做轮询"""
+        process.wait()
+        self._on_exit(process)
+
+    def _on_exit(self, process):
+        """进程退出后更新状态；监视线程和停止流程都会调用，只处理一次
+
+        锁内只更新状态，查找崩溃报告、复制日志和写状态库都在锁外进行，不阻塞状态查询。
+        """
+        with self.lock:
+            if self.process is not process:
+                return
+            self.process = None
+            self.exit_code = process.returncode
+            if minecraft_processes.get(self.server_id) is process:
+                del minecraft_processes[self.server_id]
+            server = config["servers"].get(self.server_id)
+            server_path = os.path.abspath(server['server_path']) if server is not None else None
+            started_at = self.started_at
+            crashed = False
+            if self.state == 'stopping':
+                self._set('stopped')
+            elif process.returncode == 0:
+                # 正常退出（如未同意EULA、插件执行了停止）不算崩溃，也不自动重启
+                self._set('stopped', "服务器已自行退出")
+            elif server is None:
+                self._set('stopped')
+            else:
+                crashed = True
+                self._set('crashed', f"服务器进程意外退出，退出码 {process.returncode}")
+        if server_path is not None:
+            remove_server_pid_file(server_path, process.pid)
+        if not crashed:
+            return
         
-        # 启动进程并重定向输出到日志文件
-        log_file = os.path.join(logs_dir, 'latest.log')
-        with open(log_file, 'w', encoding='utf-8') as f:
-            # 使用CREATE_NO_WINDOW标志来隐藏控制台窗口（仅在Windows上有效）
-            startupinfo = None
-            if os.name == 'nt':
-                startupinfo = subprocess.STARTUPINFO()
-                startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-                startupinfo.wShowWindow = subprocess.SW_HIDE
-            
-            minecraft_processes[server_id] = subprocess.Popen(
-                cmd,
-                cwd=server_path,
-                stdout=f,
-                stderr=f,
-                stdin=subprocess.PIPE,
-                text=True,
-                bufsize=1,  # 行缓冲，确保日志及时写入
-                startupinfo=startupinfo
-            )
+        now = time.time()
+        crash_report = find_crash_report(server_path, started_at or now)
+        # 自动重启会清空latest.log，必须在安排重启之前另存
+        crash_log = save_crash_log(server_path)
+        print(f"服务器 {self.server_id} 进程意外退出，退出码 {process.returncode}"
+              + (f"，崩溃报告: {crash_report}" if crash_report else ""))
+        try:
+            state_store.add_crash(self.server_id, process.returncode, crash_report, crash_log, now)
+        except Exception as e:
+            print(f"保存崩溃记录失败: {str(e)}")
+        with self.lock:
+            # 处理期间已被手动启动或停止时不再安排重启
+            if self.state == 'crashed' and self.process is None:
+                self.crash_report = crash_report
+                self._schedule_restart(now)
+
+    def _schedule_restart(self, now):
+        """按指数退避安排自动重启，窗口内崩溃次数超过上限时放弃，调用方需持有锁"""
+        settings = get_auto_restart_settings(self.server_id)
+        if not settings['enabled']:
+            return
+        window = settings['crash_window']
+        self.crash_times.append(now)
+        while self.crash_times and now - self.crash_times[0] > window:
+            self.crash_times.popleft()
+        crashes = len(self.crash_times)
+        if crashes > settings['max_crashes']:
+            self.message += f"；{int(window)}秒内崩溃 {crashes} 次，已停止自动重启"
+            return
+        delay = min(settings['max_delay'], settings['initial_delay'] * 2 ** (crashes - 1))
+        self.restart_at = now + delay
+        self.message += f"；{delay:g}秒后自动重启（第 {crashes} 次）"
+        self.restart_timer = threading.Timer(delay, self._auto_restart)
+        self.restart_timer.daemon = True
+        self.restart_timer.start()
+
+    def _auto_restart(self):
+        accepted, message = self.start(auto=True)
+        if not accepted:
+            print(f"自动重启服务器 {self.server_id} 失败: {message}")
+            with self.lock:
+                self.restart_at = None
+        # start() 启动成功时已清除restart_at
+
+    def _cancel_restart(self):
+        """取消等待中的自动重启，调用方需持有锁"""
+        if self.restart_timer is not None:
+            self.restart_timer.cancel()
+        self.restart_timer = None
+        self.restart_at = None
+
+def is_stop_command(command):
+    """是否为停止服务器的控制台命令"""
+    return command.strip().lower() in SERVER_STOP_COMMANDS
+
+def get_lifecycle(server_id):
+    """获取或创建服务器的生命周期状态机"""
+    with server_lifecycles_lock:
+        lifecycle = server_lifecycles.get(server_id)
+        if lifecycle is None:
+            lifecycle = server_lifecycles[server_id] = ServerLifecycle(server_id)
+        return lifecycle
+
+@app.route('/api/start/<server_id>', methods=['POST'])
+@login_required
+def start_server(server_id):
+    if server_id not in config["servers"]:
+        return jsonify({"status": "error", "message": "服务器不存在"})
+    
+    # 立即返回，启动进度通过状态接口查看
+    accepted, message = get_lifecycle(server_id).start()
+    return jsonify({"status": "success" if accepted else "error", "message": message})
+
+@app.route('/api/stop/<server_id>', methods=['POST'])
+@login_required
+def stop_server(server_id):
+    if server_id not in config["servers"]:
+        return jsonify({"status": "error", "message": "服务器不存在"})
+    
+    # 立即返回，停止进度通过状态接口查看
+    accepted, message = get_lifecycle(server_id).stop()
+    return jsonify({"status": "success" if accepted else "error", "message": message})
+
+def sample_processes():
+    """采样所有运行中服务器的CPU、内存、线程数和磁盘IO"""
+    cpu_count = psutil.cpu_count() or 1
+    for server_id, process in list(minecraft_processes.items()):
+        if process.poll() is not None:
+            process_handles.pop(server_id, None)
+            process_samples.pop(server_id, None)
+            continue
+        try:
+            proc = process_handles.get(server_id)
+            if proc is None or proc.pid != process.pid:
+                proc = psutil.Process(process.pid)
+                process_handles[server_id] = proc
+            with proc.oneshot():
+                # 首次调用返回0，之后返回距上次采样的平均值
+                cpu_percent = proc.cpu_percent() / cpu_count
+                memory_info = proc.memory_info()
+                num_threads = proc.num_threads()
+                create_time = proc.create_time()
+                try:
+                    io = proc.io_counters()
+                except (psutil.AccessDenied, AttributeError):
+                    io = None
+            process_samples[server_id] = {
+                "status": "running",
+                "pid": process.pid,
+                "cpu_percent": round(cpu_percent, 2),
+                "memory_mb": round(memory_info.rss / 1024 / 1024, 2),
+                "memory_rss_bytes": memory_info.rss,
+                "threads": num_threads,
+                "io_read_bytes": io.read_bytes if io else None,
+                "io_write_bytes": io.write_bytes if io else None,
+                "started_at": create_time,
+                "sampled_at": time.time()
+            }
+        except psutil.Error:
+            process_handles.pop(server_id, None)
+            process_samples.pop(server_id, None)
+    # 清理已不在进程表中的句柄
+    for server_id in list(process_handles):
+        if server_id not in minecraft_processes:
+            process_handles.pop(server_id, None)
+            process_samples.pop(server_id, None)
+
+def sample_host():
+    """采样主机的CPU、内存、负载、磁盘和网络"""
+    global host_stats
+    now = time.time()
+    # interval=None时返回距上次调用的平均值，不会阻塞
+    cpu_percent = psutil.cpu_percent(interval=None)
+    memory = psutil.virtual_memory()
+    try:
+        load_avg = [round(x, 2) for x in psutil.getloadavg()]
+    except (AttributeError, OSError):
+        load_avg = None
+    disk = psutil.disk_usage(os.path.abspath('.'))
+    net = psutil.net_io_counters()
+    
+    # 根据上一次采样计算网络速率
+    previous = host_stats
+    net_sent_rate = net_recv_rate = 0
+    if previous.get("sampled_at") and net:
+        elapsed = now - previous["sampled_at"]
+        if elapsed > 0:
+            net_sent_rate = max(0, net.bytes_sent - previous["net_bytes_sent"]) / elapsed
+            net_recv_rate = max(0, net.bytes_recv - previous["net_bytes_recv"]) / elapsed
+    
+    host_stats = {
+        "cpu_percent": cpu_percent,
+        "cpu_count": psutil.cpu_count(),
+        "memory_percent": memory.percent,
+        "memory_used": round(memory.used / (1024 * 1024 * 1024), 2),  # GB
+        "memory_total": round(memory.total / (1024 * 1024 * 1024), 2),  # GB
+        "load_avg": load_avg,
+        "disk_percent": disk.percent,
+        "disk_used": round(disk.used / (1024 * 1024 * 1024), 2),  # GB
+        "disk_total": round(disk.total / (1024 * 1024 * 1024), 2),  # GB
+        "net_bytes_sent": net.bytes_sent if net else 0,
+        "net_bytes_recv": net.bytes_recv if net else 0,
+        "net_sent_rate": round(net_sent_rate, 1),  # 字节/秒
+        "net_recv_rate": round(net_recv_rate, 1),  # 字节/秒
+        "sampled_at": now
+    }
+
+class MetricArchive:
+    """固定大小的环形时序存储（类似RRD）
+
+    槽位由 时间戳 // 步长 % 容量 决定，每个槽位依次存放桶时间和各字段的值，
+    全部是定长的double。持久化的存档直接mmap到文件上，查询时只读取需要的槽位。
+    """
+    def __init__(self, step, capacity, fields, path=None):
+        self.step = step
+        self.capacity = capacity
+        self.width = len(fields) + 1
+        size = capacity * self.width * 8
+        self.file = None
+        if path:
+            if not os.path.exists(path) or os.path.getsize(path) != size:
+                # 新建或字段变化时用NaN填充整个文件
+                with open(path, 'wb') as f:
+                    f.write(struct.pack('d', math.nan) * (capacity * self.width))
+            self.file = open(path, 'r+b')
+            self.buffer = mmap.mmap(self.file.fileno(), size)
+        else:
+            self.buffer = bytearray(struct.pack('d', math.nan) * (capacity * self.width))
+        self.values = memoryview(self.buffer).cast('d')
+
+    def put(self, timestamp, values):
+        bucket = int(timestamp // self.step)
+        base = (bucket % self.capacity) * self.width
+        self.values[base] = bucket * self.step
+        for i, value in enumerate(values, 1):
+            self.values[base + i] = math.nan if value is None else value
+
+    def copy_slots(self, first_bucket, last_bucket):
+        """复制覆盖[first_bucket, last_bucket]的槽位原始数据，范围超过容量时复制整个环"""
+        count = last_bucket - first_bucket + 1
+        if count >= self.capacity:
+            return self.values.tolist()
+        start = first_bucket % self.capacity
+        end = start + count
+        if end <= self.capacity:
+            return self.values[start * self.width:end * self.width].tolist()
+        return self.values[start * self.width:].tolist() + self.values[:(end - self.capacity) * self.width].tolist()
+
+    def decode_slots(self, data):
+        """把复制出的槽位整理成 {桶序号: 各字段值}，没写过的槽位跳过"""
+        rows = {}
+        for base in range(0, len(data), self.width):
+            bucket_time = data[base]
+            if not math.isnan(bucket_time):
+                rows[int(bucket_time) // self.step] = data[base + 1:base + self.width]
+        return rows
+
+    def covers(self, timestamp, now):
+        return timestamp >= now - self.step * self.capacity
+
+    def flush(self):
+        if self.file:
+            self.buffer.flush()
+
+    def close(self):
+        self.values.release()
+        if self.file:
+            self.buffer.close()
+            self.file.close()
+
+class MetricStore:
+    """一组指标的全部历史，写入秒级数据时同步更新分钟和小时汇总"""
+    def __init__(self, key, fields):
+        self.key = key
+        self.fields = fields
+        self.lock = threading.Lock()
+        self.archives = []
+        for step, capacity, persist in METRIC_ARCHIVES:
+            path = os.path.join(METRICS_DIR, f"{key}_{step}s.rrd") if persist else None
+            self.archives.append(MetricArchive(step, capacity, fields, path))
+        # 各汇总级别当前桶的 [桶序号, 各字段总和, 各字段计数]
+        self.pending = [None] * len(self.archives)
+
+    def record(self, timestamp, values):
+        with self.lock:
+            self.archives[0].put(timestamp, values)
+            if len(self.archives) > 1:
+                self._accumulate(1, timestamp, values)
+
+    def _accumulate(self, level, timestamp, values):
+        """累加到汇总桶并写入当前平均值；桶结束时把平均值交给下一级"""
+        archive = self.archives[level]
+        bucket = int(timestamp // archive.step)
+        pending = self.pending[level]
+        if pending is not None and pending[0] != bucket:
+            archive.flush()
+            if level + 1 < len(self.archives):
+                self._accumulate(level + 1, pending[0] * archive.step, self._average(pending))
+            pending = None
+        if pending is None:
+            pending = self.pending[level] = [bucket, [0.0] * len(self.fields), [0] * len(self.fields)]
+        for i, value in enumerate(values):
+            if value is not None and not math.isnan(value):
+                pending[1][i] += value
+                pending[2][i] += 1
+        archive.put(timestamp, self._average(pending))
+
+    @staticmethod
+    def _average(pending):
+        return [total / count if count else None for total, count in zip(pending[1], pending[2])]
+
+    def query(self, start, end, step):
+        """按固定步长返回对齐的序列，空缺处为None"""
+        now = time.time()
+        # 在能覆盖起始时间的存档中，选步长不超过请求步长的最粗一级
+        covering = [a for a in self.archives if a.covers(start, now)] or [self.archives[-1]]
+        fitting = [a for a in covering if a.step <= step]
+        archive = fitting[-1] if fitting else covering[0]
+        step = max(archive.step, int(step) // archive.step * archive.step)
+        if (end - start) / step > METRIC_MAX_POINTS:
+            step = math.ceil((end - start) / METRIC_MAX_POINTS / archive.step) * archive.step
         
-        # 立即返回成功响应，不等待进程启动
-        return jsonify({"status": "success", "message": "服务器正在启动中"})
+        buckets_per_point = step // archive.step
+        points = range(int(start // step) * step, int(end) + 1, step)
+        # 持锁期间只复制需要的槽位，解析和降采样在释放锁之后进行，不阻塞采样线程写入
+        with self.lock:
+            data = archive.copy_slots(points[0] // archive.step, points[-1] // archive.step + buckets_per_point - 1)
+        rows = archive.decode_slots(data)
         
+        timestamps = list(points)
+        series = {field: [] for field in self.fields}
+        for point in points:
+            first_bucket = point // archive.step
+            totals = [0.0] * len(self.fields)
+            counts = [0] * len(self.fields)
+            for bucket in range(first_bucket, first_bucket + buckets_per_point):
+                row = rows.get(bucket)
+                if row is None:
+                    continue
+                for index, value in enumerate(row):
+                    if not math.isnan(value):
+                        totals[index] += value
+                        counts[index] += 1
+            for index, field in enumerate(self.fields):
+                series[field].append(round(totals[index] / counts[index], 2) if counts[index] else None)
+        return {"step": step, "timestamps": timestamps, "series": series}
+
+    def close(self):
+        with self.lock:
+            for archive in self.archives:
+                archive.close()
+
+def get_metric_store(key, fields):
+    with metric_stores_lock:
+        store = metric_stores.get(key)
+        if store is None:
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            store = metric_stores[key] = MetricStore(key, fields)
+        return store
+
+def remove_metric_store(key):
+    """关闭并删除一组指标的历史文件"""
+    with metric_stores_lock:
+        store = metric_stores.pop(key, None)
+    if store:
+        store.close()
+    for step, _, persist in METRIC_ARCHIVES:
+        path = os.path.join(METRICS_DIR, f"{key}_{step}s.rrd")
+        if persist and os.path.exists(path):
+            os.remove(path)
+
+def record_metrics():
+    """把最新的采样结果写入历史"""
+    now = time.time()
+    for server_id, sample in list(process_samples.items()):
+        players = len(online_players.get(server_id, {}))
+        get_metric_store(server_id, SERVER_METRIC_FIELDS).record(
+            now, [sample["cpu_percent"], sample["memory_mb"], players]
+        )
+    if host_stats:
+        get_metric_store('host', HOST_METRIC_FIELDS).record(
+            now, [host_stats[field] for field in HOST_METRIC_FIELDS]
+        )
+
+def query_metrics(key, fields):
+    """解析from/to/step参数并查询历史指标"""
+    try:
+        end = request.args.get('to', type=float) or time.time()
+        start = request.args.get('from', type=float) or end - 3600
+        if start >= end:
+            return jsonify({"status": "error", "message": "起始时间必须早于结束时间"})
+        step = request.args.get('step', type=int) or max(1, int((end - start) / METRIC_DEFAULT_POINTS))
+        data = get_metric_store(key, fields).query(start, end, max(1, step))
+        return jsonify({"status": "success", **data})
     except Exception as e:
-        return jsonify({"status": "error", "message": f"启动失败: {str(e)}"})
+        return jsonify({"status": "error", "message": f"查询历史指标失败: {str(e)}"})
 
-@app.route('/api/stop/<server_id>', methods=['POST'])
-@login_required
-def stop_server(server_id):
-    if server_id not in minecraft_processes:
-        return jsonify({"status": "error", "message": "服务器未运行"})
-    
-    process = minecraft_processes[server_id]
-    if process.poll() is None:
-        process.terminate()
-        time.sleep(2)
-        if process.poll() is None:
-            process.kill()
-        del minecraft_processes[server_id]
-        return jsonify({"status": "success", "message": "服务器已停止"})
-    return jsonify({"status": "error", "message": "服务器未运行"})
+def resource_sampler_thread():
+    """资源采样线程"""
+    while True:
+        try:
+            sample_processes()
+            sample_host()
+            record_metrics()
+        except Exception as e:
+            print(f"资源采样失败: {str(e)}")
+        time.sleep(RESOURCE_SAMPLE_INTERVAL)
+
+def get_process_sample(server_id):
+    """返回服务器进程的最新采样结果，不做任何实时采样"""
+    process = minecraft_processes.get(server_id)
+    if process is None or process.poll() is not None:
+        return {"status": "stopped"}
+    sample = process_samples.get(server_id)
+    if sample is None or sample["pid"] != process.pid:
+        # 刚启动还没有采样结果
+        return {"status": "running", "pid": process.pid, "cpu_percent": 0, "memory_mb": 0}
+    return sample
+
+def get_server_status(server_id):
+    """进程采样结果加上生命周期状态"""
+    return {**get_process_sample(server_id), **get_lifecycle(server_id).to_dict()}
 
 @app.route('/api/status/<server_id>')
 @login_required
 def get_status(server_id):
-    if server_id in minecraft_processes:
-        process = minecraft_processes[server_id]
-        if process.poll() is None:
-            try:
-                proc = psutil.Process(process.pid)
-                # 获取CPU使用率前先调用一次
-                proc.cpu_percent()
-                # 等待一小段时间后再次获取，这样可以得到准确的CPU使用率
-                time.sleep(0.1)
-                # 获取CPU核心数
-                cpu_count = psutil.cpu_count()
-                # 计算单个进程的平均CPU使用率
-                cpu_percent = proc.cpu_percent() / cpu_count if cpu_count else 0
-                # 获取内存使用情况（MB）
-                memory_mb = proc.memory_info().rss / 1024 / 1024
-                return jsonify({
-                    "status": "running",
-                    "pid": process.pid,
-                    "cpu_percent": cpu_percent,
-                    "memory_mb": round(memory_mb, 2)
-                })
-            except:
-                del minecraft_processes[server_id]
-    return jsonify({"status": "stopped"})
+    return jsonify(get_server_status(server_id))
+
+@app.route('/api/servers/<server_id>/crashes')
+@login_required
+def get_server_crashes(server_id):
+    """获取服务器的崩溃记录（退出码和崩溃报告路径）"""
+    if server_id not in config["servers"]:
+        return jsonify({"status": "error", "message": "服务器不存在"})
+    return jsonify({"status": "success", "crashes": state_store.crashes(server_id)})
+
+@app.route('/api/servers/<server_id>/metrics')
+@login_required
+def get_server_metrics(server_id):
+    """查询服务器的历史指标"""
+    if server_id not in config["servers"]:
+        return jsonify({"status": "error", "message": "服务器不存在"})
+    return query_metrics(server_id, SERVER_METRIC_FIELDS)
 
 def translate_log(log_line):
     """翻译日志内容"""
-    for eng, chn in LOG_TRANSLATIONS.items():
-        if eng in log_line:
-            log_line = log_line.replace(eng, chn)
-    return log_line
+    return log_translator.translate(log_line)
+
+def rebuild_log_translator():
+    """合并内置翻译表和配置中的自定义翻译表，重新编译翻译器"""
+    global log_translator
+    translations = dict(LOG_TRANSLATIONS)
+    translations.update(config.get("log_translations") or {})
+    log_translator = LogTranslator(translations)
+
+def read_log_tail(log_file, max_lines=LOG_TAIL_LINES):
+    """从文件末尾向前读取最后若干行，返回(日志行列表, 游标)
+
+    游标是最后一个完整行之后的字节偏移，未写完的半行留到下次读取。
+    """
+    with open(log_file, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        pos = end
+        data = b''
+        # 按块向前读取，直到凑够所需行数或到达文件开头
+        while pos > 0 and data.count(b'\n') <= max_lines:
+            step = min(LOG_READ_BLOCK, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+    newline = data.rfind(b'\n')
+    if newline < 0:
+        return [], pos
+    cursor = pos + newline + 1
+    lines = [line.strip() for line in data[:newline].decode('utf-8', errors='ignore').split('\n')]
+    lines = [line for line in lines if line]
+    return lines[-max_lines:], cursor
+
+def read_log_since(log_file, cursor):
+    """读取游标之后新追加的完整行，返回(日志行列表, 新游标)
+
+    文件被截断（服务器重启时以'w'重新打开）或落后太多时返回None，由调用方重新读取末尾。
+    """
+    with open(log_file, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if cursor > size or size - cursor > LOG_MAX_READ:
+            return None
+        f.seek(cursor)
+        data = f.read(size - cursor)
+    newline = data.rfind(b'\n')
+    if newline < 0:
+        return [], cursor
+    lines = [line.strip() for line in data[:newline].decode('utf-8', errors='ignore').split('\n')]
+    return [line for line in lines if line], cursor + newline + 1
 
 @app.route('/api/logs/<server_id>')
 @login_required
 def get_logs(server_id):
+    """增量读取日志
+
+    不带cursor时返回末尾100行；带cursor时只返回此后新增的行。
+    generation与服务器启动次数对应，变化说明日志文件已被重新创建。
+    """
     if server_id not in config["servers"]:
         return jsonify({"status": "error", "message": "服务器不存在"})
     
     server = config["servers"][server_id]
     log_file = os.path.join(server['server_path'], 'logs', 'latest.log')
+    generation = log_generations.get(server_id, 0)
     
     try:
         if os.path.exists(log_file):
-            with open(log_file, 'r', encoding='utf-8', errors='ignore') as f:
-                # 读取最后100行日志
-                logs = []
-                for line in f:
-                    line = line.strip()
-                    if line:  # 忽略空行
-                        logs.append(line)
-                        if len(logs) > 100:
-                            logs.pop(0)
-                # 翻译日志
-                translated_logs = [translate_log(log) for log in logs]
-            return jsonify({"logs": translated_logs})
+            cursor = request.args.get('cursor', type=int)
+            client_generation = request.args.get('generation', type=int)
+            result = None
+            if cursor is not None and cursor >= 0 and client_generation == generation:
+                result = read_log_since(log_file, cursor)
+            reset = result is None
+            if reset:
+                result = read_log_tail(log_file)
+            logs, new_cursor = result
+            # 翻译日志
+            translated_logs = [translate_log(log) for log in logs]
+            return jsonify({
+                "logs": translated_logs,
+                "cursor": new_cursor,
+                "generation": generation,
+                "reset": reset
+            })
         else:
             # 如果日志文件不存在，检查服务器是否在运行
             if server_id in minecraft_processes:
@@ -495,13 +2337,169 @@ def get_logs(server_id):
                         "status": "error",
                         "message": "服务器已停止运行"
                     })
-            return jsonify({"logs": []})
+            return jsonify({"logs": [], "cursor": 0, "generation": generation, "reset": True})
     except Exception as e:
         return jsonify({
             "status": "error",
             "message": f"读取日志失败: {str(e)}"
         })
 
+class ServerStreamHub:
+    """单个服务器的推送中心
+
+    由一个生产线程读取日志、进程采样结果、在线玩家和下载进度，再分发给所有订阅者，
+    这样无论有多少个浏览器在看，读取开销都只有一份。
+    """
+    def __init__(self, server_id):
+        self.server_id = server_id
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.thread = None
+        self.log_cursor = None
+        self.log_generation = None
+        self.recent_logs = deque(maxlen=LOG_TAIL_LINES)
+        self.last_status = None
+        self.last_players = None
+        self.last_download = None
+
+    def subscribe(self):
+        """添加订阅者，先推送当前快照"""
+        q = Queue(maxsize=STREAM_QUEUE_SIZE)
+        with self.lock:
+            if self.log_cursor is not None:
+                q.put(('log', {"logs": list(self.recent_logs), "reset": True}))
+            if self.last_status is not None:
+                q.put(('status', self.last_status))
+            if self.last_players is not None:
+                q.put(('players', self.last_players))
+            self.subscribers.add(q)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+        return q
+
+    def unsubscribe(self, q):
+        with self.lock:
+            self.subscribers.discard(q)
+
+    def _broadcast(self, event, data):
+        """向所有订阅者分发事件，调用方需持有锁"""
+        for q in self.subscribers:
+            try:
+                q.put_nowait((event, data))
+            except Full:
+                # 消费过慢的订阅者丢弃最旧的事件
+                try:
+                    q.get_nowait()
+                    q.put_nowait((event, data))
+                except (Empty, Full):
+                    pass
+
+    def _run(self):
+        while True:
+            with self.lock:
+                if not self.subscribers:
+                    # 没有订阅者时退出，下次订阅重新读取末尾日志
+                    self.thread = None
+                    self.log_cursor = None
+                    self.last_status = None
+                    self.last_players = None
+                    return
+            try:
+                self._poll_logs()
+                self._poll_status()
+                self._poll_players()
+                self._poll_download()
+            except Exception as e:
+                print(f"推送服务器 {self.server_id} 状态失败: {str(e)}")
+            time.sleep(STREAM_POLL_INTERVAL)
+
+    def _poll_logs(self):
+        server = config["servers"].get(self.server_id)
+        if not server:
+            return
+        log_file = os.path.join(server['server_path'], 'logs', 'latest.log')
+        if not os.path.exists(log_file):
+            return
+        generation = log_generations.get(self.server_id, 0)
+        result = None
+        if self.log_cursor is not None and generation == self.log_generation:
+            result = read_log_since(log_file, self.log_cursor)
+        reset = result is None
+        if reset:
+            result = read_log_tail(log_file)
+        lines, self.log_cursor = result
+        self.log_generation = generation
+        if not lines and not reset:
+            return
+        lines = [translate_log(line) for line in lines]
+        with self.lock:
+            if reset:
+                self.recent_logs.clear()
+            self.recent_logs.extend(lines)
+            self._broadcast('log', {"logs": lines, "reset": reset})
+
+    def _poll_status(self):
+        status = get_server_status(self.server_id)
+        if status != self.last_status:
+            with self.lock:
+                self.last_status = status
+                self._broadcast('status', status)
+
+    def _poll_players(self):
+        players = get_online_players(self.server_id)
+        data = {"status": "success", "players": players, "count": len(players)}
+        if data != self.last_players:
+            with self.lock:
+                self.last_players = data
+                self._broadcast('players', data)
+
+    def _poll_download(self):
+        download = download_status.get(self.server_id)
+        if download is not None and download != self.last_download:
+            download = dict(download)
+            with self.lock:
+                self.last_download = download
+                self._broadcast('download', download)
+
+def get_stream_hub(server_id):
+    """获取或创建服务器的推送中心"""
+    with stream_hubs_lock:
+        hub = stream_hubs.get(server_id)
+        if hub is None:
+            hub = stream_hubs[server_id] = ServerStreamHub(server_id)
+        return hub
+
+@app.route('/api/servers/<server_id>/stream')
+@login_required
+def stream_server(server_id):
+    """通过SSE推送控制台日志、服务器状态、在线玩家和下载进度"""
+    if server_id not in config["servers"]:
+        return jsonify({"status": "error", "message": "服务器不存在"})
+    
+    hub = get_stream_hub(server_id)
+    q = hub.subscribe()
+    
+    def generate():
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                try:
+                    event, data = q.get(timeout=STREAM_HEARTBEAT)
+                except Empty:
+                    # 心跳，顺便检测断开的连接
+                    yield ': ping\n\n'
+                    continue
+                yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        finally:
+            hub.unsubscribe(q)
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 # 文件管理相关API
 @app.route('/api/files/<server_id>')
 @login_required
@@ -527,6 +2525,33 @@ def list_files(server_id):
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)})
 
+@app.route('/api/files/<server_id>/download')
+@login_required
+def download_file(server_id):
+    """下载文件（支持断点续传），目录则边压缩边下载"""
+    if server_id not in config["servers"]:
+        return jsonify({"status": "error", "message": "服务器不存在"})
+    
+    server = config["servers"][server_id]
+    path = request.args.get('path', '')
+    full_path = os.path.join(server['server_path'], path)
+    if not is_within_directory(server['server_path'], full_path):
+        return jsonify({"status": "error", "message": "非法路径"})
+    
+    try:
+        if os.path.isdir(full_path):
+            name = os.path.basename(os.path.normpath(full_path)) or server['name']
+            return Response(
+                stream_with_context(stream_directory_zip(full_path)),
+                mimetype='application/zip',
+                headers={'Content-Disposition': attachment_header(name + '.zip')}
+            )
+        if not os.path.isfile(full_path):
+            return jsonify({"status": "error", "message": "文件不存在"})
+        return send_download(full_path, os.path.basename(full_path))
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)})
+
 @app.route('/api/files/<server_id>/content', methods=['GET'])
 @login_required
 def get_file_content(server_id):
@@ -559,6 +2584,7 @@ def save_file_content(server_id):
     full_path = os.path.join(server['server_path'], path)
     
     try:
+        break_hardlink(full_path)
         with open(full_path, 'w', encoding='utf-8') as f:
             f.write(content)
         return jsonify({"status": "success"})
@@ -580,6 +2606,7 @@ def upload_file(server_id):
     
     try:
         full_path = os.path.join(server['server_path'], path, file.filename)
+        break_hardlink(full_path)
         file.save(full_path)
         return jsonify({"status": "success"})
     except Exception as e:
@@ -596,70 +2623,186 @@ def delete_file(server_id):
     full_path = os.path.join(server['server_path'], path)
     
     try:
-        if os.path.isdir(full_path):
-            shutil.rmtree(full_path)
-        else:
-            os.remove(full_path)
+        if os.path.isdir(full_path) and not os.path.islink(full_path):
+            # 目录可能很大，交给后台任务删除
+            job = job_manager.submit(
+                'delete', server_id, lambda job: remove_path_job(job, full_path),
+                f"删除 {path}", pool='io'
+            )
+            return jsonify({"status": "success", "job_id": job.id})
+        os.remove(full_path)
         return jsonify({"status": "success"})
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)})
 
+@app.route('/api/files/<server_id>/extract', methods=['POST'])
+@login_required
+def extract_file(server_id):
+    """在后台解压压缩包，默认解压到压缩包所在目录"""
+    if server_id not in config["servers"]:
+        return jsonify({"status": "error", "message": "服务器不存在"})
+    
+    server = config["servers"][server_id]
+    path = request.json.get('path', '')
+    archive_path = os.path.join(server['server_path'], path)
+    target = request.json.get('target')
+    target_dir = os.path.join(server['server_path'], target) if target is not None else os.path.dirname(archive_path)
+    
+    if not os.path.isfile(archive_path):
+        return jsonify({"status": "error", "message": "文件不存在"})
+    if not is_within_directory(server['server_path'], target_dir):
+        return jsonify({"status": "error", "message": "目标目录无效"})
+    
+    job = job_manager.submit(
+        'extract', server_id, lambda job: extract_archive_job(job, archive_path, target_dir),
+        f"解压 {path}", pool='io'
+    )
+    return jsonify({"status": "success", "job_id": job.id})
+
 # 下载核心相关API
 MIRROR_API_BASE = "https://download.fastmirror.net/api/v3"
+# 镜像目录缓存：各接口的有效期（秒），过期后先返回旧数据再在后台刷新
+MIRROR_CACHE_FILE = os.path.join('cache', 'mirror.json')
+MIRROR_CACHE_TTL = {
+    'cores': 3600,
+    'versions': 600,
+    'builds': 300,
+    'build': 7 * 24 * 3600  # 单个构建的下载信息基本不会变化
+}
+MIRROR_CACHE_MAX_ENTRIES = 500
+
+class MirrorCache:
+    """FastMirror接口缓存（内存+磁盘）
+
+    未过期直接返回；过期后返回旧数据并在后台刷新；镜像不可用时一直使用最后一次的结果。
+    相同URL的并发请求只会发出一次。
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = None
+        self.inflight = {}
+
+    def load(self):
+        if self.entries is None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+        return self.entries
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp = self.path + '.tmp'
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, ensure_ascii=False)
+        os.replace(temp, self.path)
+
+    def get(self, url, kind):
+        """返回(数据, 是否为过期数据)"""
+        with self.lock:
+            entry = self.load().get(url)
+        if entry is None:
+            return self.fetch(url), False
+        if time.time() - entry['fetched_at'] < MIRROR_CACHE_TTL[kind]:
+            return entry['data'], False
+        self.refresh_async(url)
+        return entry['data'], True
+
+    def refresh_async(self, url):
+        with self.lock:
+            if url in self.inflight:
+                return
+        def refresh():
+            try:
+                self.fetch(url)
+            except Exception as e:
+                print(f"刷新镜像缓存失败 {url}: {str(e)}")
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def fetch(self, url):
+        """请求镜像并更新缓存，同一URL同时只有一个请求，其余等待其结果"""
+        with self.lock:
+            future = self.inflight.get(url)
+            owner = future is None
+            if owner:
+                future = self.inflight[url] = Future()
+        if not owner:
+            return future.result()
+        try:
+            response = http_session.get(url, timeout=HTTP_TIMEOUT)
+            if not response.ok:
+                raise Exception(f"镜像请求失败: HTTP {response.status_code}")
+            payload = response.json()
+            if not payload.get("success"):
+                raise Exception(payload.get("message", "镜像返回错误"))
+            data = payload["data"]
+            with self.lock:
+                entries = self.load()
+                entries[url] = {'data': data, 'fetched_at': time.time()}
+                if len(entries) > MIRROR_CACHE_MAX_ENTRIES:
+                    for old in sorted(entries, key=lambda key: entries[key]['fetched_at'])[:len(entries) - MIRROR_CACHE_MAX_ENTRIES]:
+                        del entries[old]
+                self.save()
+            future.set_result(data)
+            return data
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.inflight.pop(url, None)
+
+mirror_cache = MirrorCache(MIRROR_CACHE_FILE)
+
+def get_build_info(name, mc_version, core_version):
+    """获取单个构建的下载信息（文件名、sha1、下载地址）"""
+    return mirror_cache.get(f"{MIRROR_API_BASE}/{name}/{mc_version}/{core_version}", 'build')[0]
 
 @app.route('/api/cores')
 @login_required
 def get_cores():
     try:
-        response = requests.get(MIRROR_API_BASE)
-        if response.ok:
-            data = response.json()
-            if data.get("success"):
-                cores = []
-                for core in data["data"]:
-                    # 添加一些有用的信息
-                    cores.append({
-                        "name": core["name"],
-                        "tag": core["tag"],
-                        "homepage": core["homepage"],
-                        "recommend": core["recommend"]
-                    })
-                return jsonify({"status": "success", "cores": cores})
-        return jsonify({"status": "error", "message": "获取核心列表失败"})
+        data, stale = mirror_cache.get(MIRROR_API_BASE, 'cores')
+        cores = []
+        for core in data:
+            # 添加一些有用的信息
+            cores.append({
+                "name": core["name"],
+                "tag": core["tag"],
+                "homepage": core["homepage"],
+                "recommend": core["recommend"]
+            })
+        return jsonify({"status": "success", "cores": cores, "stale": stale})
     except Exception as e:
-        return jsonify({"status": "error", "message": str(e)})
+        return jsonify({"status": "error", "message": f"获取核心列表失败: {str(e)}"})
 
 @app.route('/api/cores/<name>')
 @login_required
 def get_core_versions(name):
     try:
-        response = requests.get(f"{MIRROR_API_BASE}/{name}")
-        if response.ok:
-            data = response.json()
-            if data.get("success"):
-                return jsonify({
-                    "status": "success", 
-                    "versions": data["data"]["mc_versions"]
-                })
-        return jsonify({"status": "error", "message": "获取版本列表失败"})
+        data, stale = mirror_cache.get(f"{MIRROR_API_BASE}/{name}", 'versions')
+        return jsonify({
+            "status": "success", 
+            "versions": data["mc_versions"],
+            "stale": stale
+        })
     except Exception as e:
-        return jsonify({"status": "error", "message": str(e)})
+        return jsonify({"status": "error", "message": f"获取版本列表失败: {str(e)}"})
 
 @app.route('/api/cores/<name>/<mc_version>')
 @login_required
 def get_core_builds(name, mc_version):
     try:
-        response = requests.get(f"{MIRROR_API_BASE}/{name}/{mc_version}")
-        if response.ok:
-            data = response.json()
-            if data.get("success"):
-                return jsonify({
-                    "status": "success", 
-                    "builds": data["data"]["builds"]
-                })
-        return jsonify({"status": "error", "message": "获取构建版本失败"})
+        data, stale = mirror_cache.get(f"{MIRROR_API_BASE}/{name}/{mc_version}", 'builds')
+        return jsonify({
+            "status": "success", 
+            "builds": data["builds"],
+            "stale": stale
+        })
     except Exception as e:
-        return jsonify({"status": "error", "message": str(e)})
+        return jsonify({"status": "error", "message": f"获取构建版本失败: {str(e)}"})
 
 @app.route('/api/download/<server_id>', methods=['POST'])
 @login_required
@@ -680,20 +2823,27 @@ def download_core(server_id):
     
     try:
         # 先获取下载信息
-        metadata_response = requests.get(f"{MIRROR_API_BASE}/{name}/{mc_version}/{core_version}")
-        if not metadata_response.ok:
-            return jsonify({"status": "error", "message": "获取下载信息失败"})
-        
-        metadata = metadata_response.json()
-        if not metadata.get("success"):
-            return jsonify({"status": "error", "message": metadata.get("message", "获取下载信息失败")})
+        try:
+            metadata = get_build_info(name, mc_version, core_version)
+        except Exception as e:
+            return jsonify({"status": "error", "message": f"获取下载信息失败: {str(e)}"})
         
-        # 将下载信息添加到任务队列
-        download_queue.put((server_id, name, mc_version, core_version))
+        # 将下载添加到后台任务
+        download_status[server_id] = {
+            "status": "downloading",
+            "progress": 0,
+            "message": "等待下载..."
+        }
+        job = job_manager.submit(
+            'download', server_id,
+            lambda job: run_core_download(job, server_id, name, mc_version, core_version),
+            f"下载核心 {name} {mc_version} {core_version}"
+        )
         return jsonify({
             "status": "success", 
             "message": "已添加到下载队列",
-            "filename": metadata["data"]["filename"]
+            "filename": metadata["filename"],
+            "job_id": job.id
         })
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)})
@@ -771,26 +2921,23 @@ def get_java_paths():
         for java_info in config.get("java_paths", {}).get("manual", []):
             if isinstance(java_info, str):
                 # 处理旧格式的数据
-                path = java_info
-                try:
-                    if os.path.isfile(path):
-                        result = subprocess.run([path, '-version'], capture_output=True, text=True, stderr=subprocess.PIPE)
-                        version = result.stderr.split('\n')[0]
-                        manual_paths.append({
-                            'path': path,
-                            'version': version,
-                            'manual': True
-                        })
-                except:
-                    continue
+                info = java_registry.probe(java_info)
+                if info:
+                    manual_paths.append(dict(info, manual=True))
             else:
                 # 新格式的数据，保留原有版本信息
                 manual_paths.append(java_info)
         
+        # 自动发现的Java，去掉已经列出的
+        listed = {auto_java['real_path']} if auto_java else set()
+        listed.update(os.path.realpath(java['path']) for java in manual_paths)
+        detected_paths = [info for info in java_registry.discover() if info['real_path'] not in listed]
+        
         return jsonify({
             "status": "success",
             "auto_paths": auto_java,
-            "manual_paths": manual_paths
+            "manual_paths": manual_paths,
+            "detected_paths": detected_paths
         })
     except Exception as e:
         return jsonify({
@@ -849,50 +2996,44 @@ def add_java_path():
     
     try:
         # 验证Java路径
-        startupinfo = None
-        if os.name == 'nt':
-            startupinfo = subprocess.STARTUPINFO()
-            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-            startupinfo.wShowWindow = subprocess.SW_HIDE
-            
-        process = subprocess.Popen([path, '-version'], 
-                                stdout=subprocess.PIPE, 
-                                stderr=subprocess.PIPE,
-                                text=True,
-                                startupinfo=startupinfo)
-        _, stderr = process.communicate()
-        version = stderr.split('\n')[0]
+        info = java_registry.probe(path)
+        if not info:
+            raise Exception("无法运行该Java")
+        version = info['version']
         
         # 创建Java信息对象
         java_info = {
             'path': path,
             'version': version,
+            'vendor': info['vendor'],
+            'arch': info['arch'],
             'manual': True,
             'added_time': datetime.now().isoformat()
         }
         
-        # 确保配置文件中有java_paths结构
-        if 'java_paths' not in config:
-            config['java_paths'] = {'auto': '', 'manual': []}
-        if 'manual' not in config['java_paths']:
-            config['java_paths']['manual'] = []
-            
-        # 检查是否已存在
-        exists = False
-        for i, existing in enumerate(config['java_paths']['manual']):
-            if isinstance(existing, dict) and existing['path'] == path:
-                config['java_paths']['manual'][i] = java_info
-                exists = True
-                break
-            elif isinstance(existing, str) and existing == path:
-                config['java_paths']['manual'][i] = java_info
-                exists = True
-                break
+        with config_lock:
+            # 确保配置文件中有java_paths结构
+            if 'java_paths' not in config:
+                config['java_paths'] = {'auto': '', 'manual': []}
+            if 'manual' not in config['java_paths']:
+                config['java_paths']['manual'] = []
                 
-        if not exists:
-            config['java_paths']['manual'].append(java_info)
-        
-        save_config()
+            # 检查是否已存在
+            exists = False
+            for i, existing in enumerate(config['java_paths']['manual']):
+                if isinstance(existing, dict) and existing['path'] == path:
+                    config['java_paths']['manual'][i] = java_info
+                    exists = True
+                    break
+                elif isinstance(existing, str) and existing == path:
+                    config['java_paths']['manual'][i] = java_info
+                    exists = True
+                    break
+                    
+            if not exists:
+                config['java_paths']['manual'].append(java_info)
+            
+            save_config()
         
         return jsonify({
             "status": "success",
@@ -914,20 +3055,21 @@ def remove_java_path(path):
         manual_paths = config['java_paths']['manual']
         
         # 检查是否有服务器正在使用这个Java路径
-        for server_id, server in config['servers'].items():
-            if server['java_path'] == path:
-                return jsonify({
-                    "status": "error",
-                    "message": f"无法删除，该Java路径正在被服务器 {server['name']} 使用"
-                })
+        using = state_store.servers_using_java(path)
+        if using:
+            return jsonify({
+                "status": "error",
+                "message": f"无法删除，该Java路径正在被服务器 {using[0]} 使用"
+            })
         
         # 查找并删除匹配的路径
-        for i, java_info in enumerate(manual_paths):
-            if (isinstance(java_info, dict) and java_info['path'] == path) or \
-               (isinstance(java_info, str) and java_info == path):
-                del manual_paths[i]
-                save_config()
-                return jsonify({"status": "success"})
+        with config_lock:
+            for i, java_info in enumerate(manual_paths):
+                if (isinstance(java_info, dict) and java_info['path'] == path) or \
+                   (isinstance(java_info, str) and java_info == path):
+                    del manual_paths[i]
+                    save_config()
+                    return jsonify({"status": "success"})
                 
         return jsonify({
             "status": "error",
@@ -954,18 +3096,17 @@ def execute_command(server_id):
     process = minecraft_processes[server_id]
     if process.poll() is None:
         try:
-            process.stdin.write(command + '\n')
-            process.stdin.flush()
+            if is_stop_command(command):
+                # 通过生命周期停止，状态经过stopping再到stopped
+                accepted, message = get_lifecycle(server_id).stop()
+                if not accepted:
+                    return jsonify({"status": "error", "message": message})
+            else:
+                process.stdin.write(command + '\n')
+                process.stdin.flush()
             
             # 记录命令历史
-            if server_id not in command_history:
-                command_history[server_id] = []
-            command_history[server_id].append({
-                "command": command,
-                "timestamp": datetime.now().isoformat()
-            })
-            if len(command_history[server_id]) > 50:  # 限制历史记录数量
-                command_history[server_id].pop(0)
+            state_store.add_command(server_id, command, datetime.now().isoformat())
             
             return jsonify({"status": "success"})
         except Exception as e:
@@ -976,7 +3117,7 @@ def execute_command(server_id):
 @login_required
 def get_command_history(server_id):
     return jsonify({
-        "history": command_history.get(server_id, [])
+        "history": state_store.command_history(server_id)
     })
 
 # 快捷指令管理API
@@ -996,20 +3137,22 @@ def add_quick_command():
     if not all([name, command]):
         return jsonify({"status": "error", "message": "请提供完整信息"})
     
-    config["quick_commands"][name] = {
-        "command": command,
-        "description": description or ""
-    }
-    save_config()
+    with config_lock:
+        config["quick_commands"][name] = {
+            "command": command,
+            "description": description or ""
+        }
+        save_config()
     return jsonify({"status": "success"})
 
 @app.route('/api/quick-commands/<name>', methods=['DELETE'])
 @login_required
 def delete_quick_command(name):
-    if name in config["quick_commands"]:
-        del config["quick_commands"][name]
-        save_config()
-        return jsonify({"status": "success"})
+    with config_lock:
+        if name in config["quick_commands"]:
+            del config["quick_commands"][name]
+            save_config()
+            return jsonify({"status": "success"})
     return jsonify({"status": "error", "message": "指令不存在"})
 
 @app.route('/api/servers/<server_id>/settings', methods=['POST'])
@@ -1030,12 +3173,7 @@ def update_server_settings(server_id):
                 "message": "无效的Java路径"
             })
         try:
-            process = subprocess.Popen([java_path, '-version'], 
-                                    stdout=subprocess.PIPE, 
-                                    stderr=subprocess.PIPE,
-                                    text=True)
-            process.communicate()
-            if process.returncode != 0:
+            if not java_registry.probe(java_path):
                 return jsonify({
                     "status": "error",
                     "message": "Java路径验证失败"
@@ -1047,115 +3185,191 @@ def update_server_settings(server_id):
             })
     
     # 更新服务器设置
-    server["name"] = data.get("name", server["name"])
-    server["server_port"] = data.get("server_port", server["server_port"])
-    server["java_path"] = java_path
-    server["java_args"] = data.get("java_args", server["java_args"])
-    
-    save_config()
+    with config_lock:
+        server["name"] = data.get("name", server["name"])
+        server["server_port"] = data.get("server_port", server["server_port"])
+        server["java_path"] = java_path
+        server["java_args"] = data.get("java_args", server["java_args"])
+        server["auto_restart"] = bool(data.get("auto_restart", server.get("auto_restart", True)))
+        save_config()
     return jsonify({"status": "success"})
 
 # 定时任务相关函数
+def run_command_job(job, server_id, command):
+    """命令任务：向运行中的服务器发送命令"""
+    process = minecraft_processes.get(server_id)
+    if process is None or process.poll() is not None:
+        raise Exception("服务器未运行")
+    if is_stop_command(command):
+        # 通过生命周期停止，状态经过stopping再到stopped
+        accepted, message = get_lifecycle(server_id).stop()
+        if not accepted:
+            raise Exception(message)
+    else:
+        process.stdin.write(command + '\n')
+        process.stdin.flush()
+    print(f"定时任务执行成功: 服务器 {server_id} - 命令 {command}")
+
 def execute_scheduled_command(server_id, command):
-    """执行预定的命令"""
-    if server_id in minecraft_processes:
-        process = minecraft_processes[server_id]
-        if process.poll() is None:
+    """执行预定的命令（提交到后台任务，不等待同一服务器的备份或重启）"""
+    job_manager.submit(
+        'command', server_id,
+        lambda job: run_command_job(job, server_id, command),
+        f"定时命令: {command}",
+        exclusive=False
+    )
+
+def parse_backup_level(codec, level):
+    """校验压缩级别，返回(级别, 错误信息)；未填写时返回None使用默认级别"""
+    if level in (None, '') or codec not in BACKUP_CODEC_LEVELS:
+        return None, None
+    try:
+        level = int(level)
+    except (TypeError, ValueError):
+        return None, f"无效的压缩级别: {level}"
+    low, high = BACKUP_CODEC_LEVELS[codec]
+    if not low <= level <= high:
+        return None, f"{codec} 的压缩级别范围为 {low}-{high}"
+    return level, None
+
+def run_backup_job(job, server_id, mode='zip', keep_backups=0, codec='deflate', level=None, hot=False):
+    """备份任务：创建备份，并按保留数量清理旧备份"""
+    backup_info, error = create_backup(server_id, mode, job, codec, level, hot)
+    if error:
+        raise Exception(error)
+    
+    # 如果设置了保留数量，清理旧备份
+    if keep_backups > 0:
+        job.update(message="正在清理旧备份")
+        server = config["servers"][server_id]
+        backup_dir = os.path.join(server['server_path'], 'backups')
+        # 从索引中取出最新keep_backups个之外的备份
+        backup_catalog.sync(server_id, backup_dir)
+        expired = backup_catalog.expired(server_id, keep_backups)
+        if expired:
             try:
-                process.stdin.write(command + '\n')
-                process.stdin.flush()
-                print(f"定时任务执行成功: 服务器 {server_id} - 命令 {command}")
+                remove_backups(server_id, expired)
+                print(f"删除旧备份: {', '.join(expired)}")
             except Exception as e:
-                print(f"定时任务执行失败: {str(e)}")
+                print(f"删除旧备份失败: {str(e)}")
+    return backup_info
 
-def execute_scheduled_backup(server_id, keep_backups=5):
-    """执行定时备份"""
-    try:
-        # 创建备份
-        backup_info, error = create_backup(server_id)
-        if error:
-            print(f"定时备份失败: {error}")
-            return
-            
-        # 如果设置了保留数量，清理旧备份
-        if keep_backups > 0:
-            server = config["servers"][server_id]
-            backup_dir = os.path.join(server['server_path'], 'backups')
-            if os.path.exists(backup_dir):
-                # 获取所有备份文件并按时间排序
-                backups = []
-                for file in os.listdir(backup_dir):
-                    if file.startswith('backup_') and file.endswith('.zip'):
-                        file_path = os.path.join(backup_dir, file)
-                        backups.append((file_path, os.path.getmtime(file_path)))
-                
-                # 按时间从新到旧排序
-                backups.sort(key=lambda x: x[1], reverse=True)
-                
-                # 删除多余的备份
-                for backup_path, _ in backups[keep_backups:]:
-                    try:
-                        os.remove(backup_path)
-                        print(f"删除旧备份: {backup_path}")
-                    except Exception as e:
-                        print(f"删除旧备份失败: {str(e)}")
-        
-        print(f"定时备份成功: {backup_info['name']}")
-    except Exception as e:
-        print(f"定时备份执行失败: {str(e)}")
+def execute_scheduled_backup(server_id, keep_backups=5, mode='zip', codec='deflate', level=None, hot=False):
+    """执行定时备份（提交到后台任务）"""
+    if server_id not in config["servers"]:
+        print(f"定时备份失败: 服务器 {server_id} 不存在")
+        return
+    job_manager.submit(
+        'backup', server_id,
+        lambda job: run_backup_job(job, server_id, mode, keep_backups, codec, level, hot),
+        f"定时备份 ({mode})"
+    )
+
+def run_restart_job(job, server_id):
+    """重启任务：正常停止服务器后重新启动，等到启动完成，与同一服务器的备份互斥"""
+    lifecycle = get_lifecycle(server_id)
+    job.update(message="正在停止服务器")
+    lifecycle.stop(wait=True)
+    
+    # 等待几秒后重启
+    job.update(progress=50, message="等待重启")
+    time.sleep(RESTART_DELAY)
+    
+    job.update(message="正在启动服务器")
+    accepted, message = lifecycle.start(wait=True)
+    if not accepted:
+        raise Exception(message)
+    if lifecycle.current() != 'running':
+        raise Exception(lifecycle.message or "服务器启动失败")
+    print(f"服务器 {server_id} 重启成功")
 
 def restart_server(server_id):
-    """重启服务器"""
-    try:
-        # 先停止服务器
-        if server_id in minecraft_processes:
-            process = minecraft_processes[server_id]
-            if process.poll() is None:
-                process.terminate()
-                time.sleep(5)
-                if process.poll() is None:
-                    process.kill()
-                del minecraft_processes[server_id]
-        
-        # 等待几秒后重启
-        time.sleep(5)
-        
-        # 重启服务器
-        server = config["servers"][server_id]
-        server_path = os.path.abspath(server['server_path'])
-        jar_path = os.path.abspath(os.path.join(server_path, server['server_jar']))
-        
-        if not os.path.exists(jar_path):
-            print(f"重启失败: 服务器核心文件不存在 {jar_path}")
-            return
-            
-        logs_dir = os.path.join(server_path, 'logs')
-        os.makedirs(logs_dir, exist_ok=True)
-        
-        java_args = server['java_args'].split()
-        cmd = [server['java_path']] + java_args + ['-jar', jar_path, 'nogui']
-        
-        log_file = os.path.join(logs_dir, 'latest.log')
-        with open(log_file, 'w', encoding='utf-8') as f:
-            startupinfo = None
-            if os.name == 'nt':
-                startupinfo = subprocess.STARTUPINFO()
-                startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-                startupinfo.wShowWindow = subprocess.SW_HIDE
-            
-            minecraft_processes[server_id] = subprocess.Popen(
-                cmd,
-                cwd=server_path,
-                stdout=f,
-                stderr=f,
-                stdin=subprocess.PIPE,
-                text=True,
-                bufsize=1,
-                startupinfo=startupinfo
-            )
-        print(f"服务器 {server_id} 重启成功")
-    except Exception as e:
-        print(f"重启失败: {str(e)}")
+    """定时重启服务器（提交到后台任务，与同一服务器的备份依次执行）"""
+    if server_id not in config["servers"]:
+        print(f"定时重启失败: 服务器 {server_id} 不存在")
+        return
+    job_manager.submit('restart', server_id, lambda job: run_restart_job(job, server_id), "定时重启")
+
+def build_trigger(schedule_type, schedule_value):
+    """根据调度类型创建触发器"""
+    if schedule_type == 'cron':
+        return CronTrigger.from_crontab(schedule_value)
+    if schedule_type == 'interval':
+        return IntervalTrigger(seconds=int(schedule_value))
+    if schedule_type == 'date':
+        return DateTrigger(run_date=datetime.fromisoformat(schedule_value))
+    raise ValueError('不支持的调度类型')
+
+def schedule_task(task_id, task, trigger=None, next_run_time=None):
+    """按保存的任务信息向调度器注册任务；next_run_time用于补执行错过的一次"""
+    trigger = trigger or build_trigger(task['schedule_type'], task['schedule_value'])
+    options = {'trigger': trigger, 'id': task_id}
+    if next_run_time is not None:
+        options['next_run_time'] = next_run_time
+    if task['type'] == 'command':
+        return scheduler.add_job(execute_scheduled_command, args=[task['server_id'], task['command']], **options)
+    if task['type'] == 'backup':
+        backup_level, _ = parse_backup_level(task.get('backup_codec', 'deflate'), task.get('backup_level'))
+        return scheduler.add_job(
+            execute_scheduled_backup,
+            args=[task['server_id'], int(task.get('keep_backups', 5)), task.get('backup_mode', 'zip'),
+                  task.get('backup_codec', 'deflate'), backup_level, bool(task.get('backup_hot', False))],
+            **options
+        )
+    return scheduler.add_job(restart_server, args=[task['server_id']], **options)
+
+def missed_run_time(task, trigger, now):
+    """面板停机期间错过的最后一次执行时间（不晚于now），没有错过时返回None
+
+    错过的多次执行合并为一次，是否补执行取决于最后一次是否在宽限时间内。
+    """
+    if task['schedule_type'] == 'date':
+        return None if task.get('last_run') else trigger.run_date
+    since = task.get('last_run') or task.get('created_at')
+    if not since:
+        return None
+    since = datetime.fromisoformat(since)
+    if task['schedule_type'] == 'interval':
+        # 重新创建的间隔触发器从现在开始计时，按上次执行时间推算
+        missed = (now - since) // trigger.interval
+        return since + missed * trigger.interval if missed >= 1 else None
+    step = timedelta(microseconds=1)
+    latest = trigger.get_next_fire_time(since, since + step)
+    if latest is None or latest > now:
+        return None
+    # 宽限时间之前的执行无论哪一次都会被跳过，只需从宽限窗口开始找最后一次
+    fire = trigger.get_next_fire_time(None, max(latest, now - timedelta(seconds=SCHEDULER_MISFIRE_GRACE)))
+    while fire is not None and fire <= now:
+        latest = fire
+        fire = trigger.get_next_fire_time(fire, fire + step)
+    return latest
+
+def restore_scheduled_tasks():
+    """从状态库恢复定时任务
+
+    停机期间错过的执行在宽限时间内的合并补执行一次，超过宽限时间的跳过；
+    已经执行过或过期的一次性任务直接删除。
+    """
+    now = datetime.now().astimezone()
+    for task_id, task in state_store.load_tasks().items():
+        try:
+            trigger = build_trigger(task['schedule_type'], task['schedule_value'])
+            missed = missed_run_time(task, trigger, now)
+            next_run_time = None
+            if missed is not None and missed <= now:
+                if (now - missed).total_seconds() <= SCHEDULER_MISFIRE_GRACE:
+                    next_run_time = now
+                    print(f"定时任务 {task.get('name', task_id)} 在面板停机期间错过执行，立即补执行")
+                elif task['schedule_type'] == 'date':
+                    state_store.delete_task(task_id)
+                    continue
+            elif task['schedule_type'] == 'date' and task.get('last_run'):
+                state_store.delete_task(task_id)
+                continue
+            schedule_task(task_id, task, trigger, next_run_time)
+            scheduled_tasks[task_id] = task
+        except Exception as e:
+            print(f"恢复定时任务 {task.get('name', task_id)} 失败: {str(e)}")
 
 # 定时任务API
 @app.route('/api/tasks', methods=['GET'])
@@ -1196,60 +3410,51 @@ def create_task():
         })
     
     try:
-        # 创建触发器
-        if schedule_type == 'cron':
-            trigger = CronTrigger.from_crontab(schedule_value)
-        elif schedule_type == 'interval':
-            trigger = IntervalTrigger(seconds=int(schedule_value))
-        elif schedule_type == 'date':
-            trigger = DateTrigger(run_date=datetime.fromisoformat(schedule_value))
-        else:
+        if schedule_type not in ('cron', 'interval', 'date'):
             return jsonify({
                 'status': 'error',
                 'message': '不支持的调度类型'
             })
-        
-        # 创建任务
-        task_id = str(uuid.uuid4())
-        if task_type == 'command':
-            command = data.get('command')
-            if not command:
+        if task_type == 'command' and not data.get('command'):
+            return jsonify({
+                'status': 'error',
+                'message': '命令不能为空'
+            })
+        if task_type == 'backup' and (data.get('backup_mode', 'zip') not in BACKUP_MODES
+                                      or data.get('backup_codec', 'deflate') not in BACKUP_CODECS):
+            return jsonify({
+                'status': 'error',
+                'message': '不支持的备份模式或压缩方式'
+            })
+        if task_type == 'backup':
+            _, error = parse_backup_level(data.get('backup_codec', 'deflate'), data.get('backup_level'))
+            if error:
                 return jsonify({
                     'status': 'error',
-                    'message': '命令不能为空'
+                    'message': error
                 })
-            job = scheduler.add_job(
-                execute_scheduled_command,
-                trigger=trigger,
-                args=[server_id, command],
-                id=task_id
-            )
-        elif task_type == 'backup':
-            keep_backups = int(data.get('keep_backups', 5))
-            job = scheduler.add_job(
-                execute_scheduled_backup,
-                trigger=trigger,
-                args=[server_id, keep_backups],
-                id=task_id
-            )
-        else:  # restart
-            job = scheduler.add_job(
-                restart_server,
-                trigger=trigger,
-                args=[server_id],
-                id=task_id
-            )
         
-        # 保存任务信息
-        scheduled_tasks[task_id] = {
+        # 创建任务
+        task_id = str(uuid.uuid4())
+        task = {
             'name': name,
             'type': task_type,
             'server_id': server_id,
             'command': data.get('command'),
             'keep_backups': data.get('keep_backups', 5),
+            'backup_mode': data.get('backup_mode', 'zip'),
+            'backup_codec': data.get('backup_codec', 'deflate'),
+            'backup_level': data.get('backup_level'),
+            'backup_hot': bool(data.get('backup_hot', False)),
             'schedule_type': schedule_type,
-            'schedule_value': schedule_value
+            'schedule_value': schedule_value,
+            'created_at': datetime.now().astimezone().isoformat()
         }
+        schedule_task(task_id, task)
+        
+        # 保存任务信息
+        scheduled_tasks[task_id] = task
+        state_store.save_task(task_id, task)
         
         return jsonify({
             'status': 'success',
@@ -1270,6 +3475,7 @@ def delete_task(task_id):
         scheduler.remove_job(task_id)
         if task_id in scheduled_tasks:
             del scheduled_tasks[task_id]
+        state_store.delete_task(task_id)
         return jsonify({'status': 'success'})
     except Exception as e:
         return jsonify({
@@ -1295,17 +3501,12 @@ def update_task(task_id):
     try:
         # 更新触发器
         if schedule_type and schedule_value:
-            if schedule_type == 'cron':
-                trigger = CronTrigger.from_crontab(schedule_value)
-            elif schedule_type == 'interval':
-                trigger = IntervalTrigger(seconds=int(schedule_value))
-            elif schedule_type == 'date':
-                trigger = DateTrigger(run_date=datetime.fromisoformat(schedule_value))
-            else:
+            if schedule_type not in ('cron', 'interval', 'date'):
                 return jsonify({
                     'status': 'error',
                     'message': '不支持的调度类型'
                 })
+            trigger = build_trigger(schedule_type, schedule_value)
             
             # 重新调度任务
             scheduler.reschedule_job(
@@ -1322,6 +3523,7 @@ def update_task(task_id):
         # 更新名称
         if name:
             scheduled_tasks[task_id]['name'] = name
+        state_store.save_task(task_id, scheduled_tasks[task_id])
         
         return jsonify({'status': 'success'})
         
@@ -1331,6 +3533,37 @@ def update_task(task_id):
             'message': str(e)
         })
 
+# 后台任务API
+@app.route('/api/jobs')
+@login_required
+def list_jobs():
+    """列出后台任务，可按服务器、类型和状态过滤"""
+    jobs = job_manager.list(
+        server_id=request.args.get('server_id'),
+        job_type=request.args.get('type'),
+        status=request.args.get('status')
+    )
+    return jsonify({"status": "success", "jobs": [job.to_dict() for job in reversed(jobs)]})
+
+@app.route('/api/jobs/<job_id>')
+@login_required
+def get_job(job_id):
+    job = job_manager.get(job_id)
+    if job is not None:
+        return jsonify({"status": "success", "job": job.to_dict()})
+    # 已从内存中清理或面板重启前的任务
+    record = state_store.get_job(job_id)
+    if record is None:
+        return jsonify({"status": "error", "message": "任务不存在"})
+    return jsonify({"status": "success", "job": record})
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_job(job_id):
+    if not job_manager.cancel(job_id):
+        return jsonify({"status": "error", "message": "任务不存在或已结束"})
+    return jsonify({"status": "success"})
+
 @app.route('/api/logout', methods=['POST'])
 @login_required
 def api_logout():
@@ -1344,67 +3577,248 @@ def api_logout():
 @app.route('/api/system/stats')
 @login_required
 def get_system_stats():
-    """获取系统资源使用情况"""
-    try:
-        # CPU使用率
-        cpu_percent = psutil.cpu_percent(interval=1)
-        
-        # 内存使用率
-        memory = psutil.virtual_memory()
-        memory_percent = memory.percent
-        memory_used = memory.used / (1024 * 1024 * 1024)  # 转换为GB
-        memory_total = memory.total / (1024 * 1024 * 1024)  # 转换为GB
-        
-        return jsonify({
-            'status': 'success',
-            'cpu_percent': cpu_percent,
-            'memory_percent': memory_percent,
-            'memory_used': round(memory_used, 2),
-            'memory_total': round(memory_total, 2)
-        })
-    except Exception as e:
+    """获取系统资源使用情况（读取后台采样的缓存）"""
+    if not host_stats:
         return jsonify({
             'status': 'error',
-            'message': str(e)
+            'message': '系统状态尚未采样，请稍后再试'
         })
+    return jsonify({'status': 'success', **host_stats})
 
-def get_online_players(server_id):
-    """获取服务器在线玩家"""
-    if server_id not in minecraft_processes:
-        return []
-    
-    process = minecraft_processes[server_id]
-    if process.poll() is not None:
-        return []
-    
-    try:
-        # 发送list命令
-        process.stdin.write('list\n')
-        process.stdin.flush()
-        
-        # 读取日志文件获取最新的玩家列表
-        server = config["servers"][server_id]
+@app.route('/api/system/metrics')
+@login_required
+def get_system_metrics():
+    """查询主机的历史指标"""
+    return query_metrics('host', HOST_METRIC_FIELDS)
+
+class PlayerTracker:
+    """单个服务器的在线玩家跟踪器，增量读取日志解析玩家进出"""
+    def __init__(self, server_id):
+        self.server_id = server_id
+        self.log_cursor = None
+        self.log_generation = None
+        self.last_reconcile = time.time()
+        # 旧版本的list输出把玩家名放在下一行
+        self.expect_names = False
+
+    def poll(self):
+        server = config["servers"].get(self.server_id)
+        if not server:
+            return
         log_file = os.path.join(server['server_path'], 'logs', 'latest.log')
         if not os.path.exists(log_file):
-            return []
-        
-        # 读取最后几行日志
-        with open(log_file, 'r', encoding='utf-8') as f:
-            lines = f.readlines()[-10:]  # 读取最后10行
-            
-        # 查找包含玩家列表的行
-        for line in reversed(lines):
-            if 'There are' in line and 'players online' in line:
-                # 解析玩家列表
-                if ':' in line:
-                    players_str = line.split(':')[-1].strip()
-                    if players_str:
-                        return [p.strip() for p in players_str.split(',')]
-                break
-        return []
-    except Exception as e:
-        print(f"获取在线玩家失败: {str(e)}")
+            return
+        generation = log_generations.get(self.server_id, 0)
+        if generation != self.log_generation:
+            # 服务器重新启动，日志从头开始
+            self.log_generation = generation
+            self.log_cursor = 0
+            self.last_reconcile = time.time()
+            online_players[self.server_id] = {}
+        result = read_log_since(log_file, self.log_cursor)
+        if result is None:
+            # 落后太多或文件被截断，只读末尾并用list命令重新校准
+            result = read_log_tail(log_file)
+            self.last_reconcile = 0
+        lines, self.log_cursor = result
+        for line in lines:
+            self.parse_line(LOG_PREFIX_PATTERN.match(line).group(2))
+        if time.time() - self.last_reconcile >= PLAYER_RECONCILE_INTERVAL:
+            self.reconcile()
+
+    def parse_line(self, message):
+        players = online_players.setdefault(self.server_id, {})
+        if self.expect_names:
+            self.expect_names = False
+            self.set_players(message)
+            return
+        match = PLAYER_JOIN_PATTERN.match(message)
+        if match:
+            players.setdefault(match.group(1), time.time())
+            return
+        match = PLAYER_LEAVE_PATTERN.match(message)
+        if match:
+            players.pop(match.group(1), None)
+            return
+        match = PLAYER_LIST_PATTERN.match(message)
+        if match:
+            names = match.group(3).strip()
+            if int(match.group(1)) > 0 and not names:
+                self.expect_names = True
+            else:
+                self.set_players(names)
+
+    def set_players(self, names):
+        """用list命令的结果覆盖玩家集合，保留已知玩家的加入时间"""
+        previous = online_players.get(self.server_id, {})
+        now = time.time()
+        online_players[self.server_id] = {
+            name: previous.get(name, now)
+            for name in (n.strip() for n in names.split(','))
+            if name
+        }
+
+    def reconcile(self):
+        self.last_reconcile = time.time()
+        process = minecraft_processes.get(self.server_id)
+        if process is None or process.poll() is not None:
+            return
+        try:
+            process.stdin.write('list\n')
+            process.stdin.flush()
+        except Exception as e:
+            print(f"校准在线玩家失败: {str(e)}")
+
+def record_player_sessions(server_id, before, after):
+    """对比前后在线玩家，把进出记录写入状态库"""
+    now = time.time()
+    for player in after.keys() - before.keys():
+        state_store.open_session(server_id, player, after[player])
+    for player in before.keys() - after.keys():
+        state_store.close_session(server_id, player, now)
+
+def player_tracker_thread():
+    """在线玩家跟踪线程"""
+    while True:
+        for server_id, process in list(minecraft_processes.items()):
+            if process.poll() is not None:
+                if online_players.pop(server_id, None):
+                    state_store.close_all_sessions(server_id)
+                continue
+            tracker = player_trackers.get(server_id)
+            if tracker is None:
+                tracker = player_trackers[server_id] = PlayerTracker(server_id)
+            before = dict(online_players.get(server_id, {}))
+            try:
+                tracker.poll()
+                record_player_sessions(server_id, before, online_players.get(server_id, {}))
+            except Exception as e:
+                print(f"跟踪服务器 {server_id} 在线玩家失败: {str(e)}")
+        for server_id in list(online_players):
+            if server_id not in minecraft_processes:
+                if online_players.pop(server_id, None):
+                    state_store.close_all_sessions(server_id)
+        time.sleep(PLAYER_TRACK_INTERVAL)
+
+def on_scheduler_event(event):
+    """记录定时任务的调度延迟、错过次数和上次执行时间"""
+    global scheduler_missed_jobs
+    if event.code == EVENT_JOB_MISSED:
+        scheduler_missed_jobs += 1
+    elif event.scheduled_run_times:
+        scheduled = event.scheduled_run_times[-1]
+        scheduler_job_lag[event.job_id] = max(0.0, (datetime.now(scheduled.tzinfo) - scheduled).total_seconds())
+        # 保存上次执行时间，面板重启后据此判断停机期间是否错过执行
+        task = scheduled_tasks.get(event.job_id)
+        if task is not None:
+            task['last_run'] = scheduled.isoformat()
+            try:
+                state_store.save_task(event.job_id, task)
+            except Exception as e:
+                print(f"保存定时任务状态失败: {str(e)}")
+
+scheduler.add_listener(on_scheduler_event, EVENT_JOB_SUBMITTED | EVENT_JOB_MISSED)
+
+def format_metric_labels(labels):
+    if not labels:
+        return ''
+    parts = []
+    for key, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+def render_prometheus_metrics():
+    """生成Prometheus文本格式的指标"""
+    lines = []
+    
+    def metric(name, metric_type, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in samples:
+            lines.append(f"{name}{format_metric_labels(labels)} {value}")
+    
+    now = time.time()
+    servers = [(server_id, {"server_id": server_id, "name": server["name"]})
+               for server_id, server in config["servers"].items()]
+    samples = {server_id: process_samples.get(server_id) for server_id, _ in servers}
+    running = [(labels, samples[server_id]) for server_id, labels in servers if samples[server_id]]
+    
+    metric('ems3_server_up', 'gauge', 'Whether the Minecraft server process is running.',
+           [(labels, 1 if samples[server_id] else 0) for server_id, labels in servers])
+    metric('ems3_server_cpu_percent', 'gauge', 'Server process CPU usage normalized to all cores.',
+           [(labels, sample["cpu_percent"]) for labels, sample in running])
+    metric('ems3_server_memory_rss_bytes', 'gauge', 'Server process resident memory.',
+           [(labels, sample["memory_rss_bytes"]) for labels, sample in running])
+    metric('ems3_server_threads', 'gauge', 'Server process thread count.',
+           [(labels, sample["threads"]) for labels, sample in running])
+    metric('ems3_server_uptime_seconds', 'gauge', 'Seconds since the server process started.',
+           [(labels, round(now - sample["started_at"], 1)) for labels, sample in running])
+    metric('ems3_server_online_players', 'gauge', 'Players currently online.',
+           [(labels, len(online_players.get(server_id, {}))) for server_id, labels in servers if samples[server_id]])
+    metric('ems3_server_starts_total', 'counter', 'Server process starts since the panel started.',
+           [(labels, log_generations.get(server_id, 0)) for server_id, labels in servers])
+    backups = [(labels, last_backup_stats[server_id]) for server_id, labels in servers if server_id in last_backup_stats]
+    metric('ems3_server_last_backup_duration_seconds', 'gauge', 'Duration of the last backup.',
+           [(labels, round(stats["duration"], 3)) for labels, stats in backups])
+    metric('ems3_server_last_backup_size_bytes', 'gauge', 'Size of the last backup archive.',
+           [(labels, stats["size_bytes"]) for labels, stats in backups])
+    metric('ems3_server_last_backup_timestamp_seconds', 'gauge', 'Unix time the last backup finished.',
+           [(labels, round(stats["finished_at"], 1)) for labels, stats in backups])
+    
+    metric('ems3_download_queue_depth', 'gauge', 'Core downloads waiting in the queue.',
+           [({}, len(job_manager.list(job_type='download', status='queued')))])
+    metric('ems3_downloads_active', 'gauge', 'Core downloads in progress.',
+           [({}, sum(1 for status in list(download_status.values()) if status.get("status") == "downloading"))])
+    
+    job_counts = {}
+    for job in job_manager.list():
+        job_counts[(job.type, job.status)] = job_counts.get((job.type, job.status), 0) + 1
+    metric('ems3_jobs', 'gauge', 'Background jobs by type and status.',
+           [({"type": job_type, "status": status}, count) for (job_type, status), count in sorted(job_counts.items())])
+    
+    metric('ems3_scheduler_jobs', 'gauge', 'Scheduled tasks registered.', [({}, len(scheduled_tasks))])
+    metric('ems3_scheduler_job_lag_seconds', 'gauge', 'Delay between scheduled and actual submission of the last run.',
+           [({"task_id": task_id, "type": scheduled_tasks.get(task_id, {}).get('type', '')}, round(lag, 3))
+            for task_id, lag in list(scheduler_job_lag.items())])
+    metric('ems3_scheduler_jobs_missed_total', 'counter', 'Scheduled runs that were missed.',
+           [({}, scheduler_missed_jobs)])
+    
+    if host_stats:
+        metric('ems3_host_cpu_percent', 'gauge', 'Host CPU usage.', [({}, host_stats["cpu_percent"])])
+        metric('ems3_host_memory_percent', 'gauge', 'Host memory usage.', [({}, host_stats["memory_percent"])])
+        metric('ems3_host_disk_percent', 'gauge', 'Disk usage of the panel directory.', [({}, host_stats["disk_percent"])])
+    
+    name = 'ems3_http_request_duration_seconds'
+    lines.append(f"# HELP {name} Panel HTTP request latency.")
+    lines.append(f"# TYPE {name} histogram")
+    for (method, endpoint), (counts, total, count) in sorted(http_request_latency.snapshot().items()):
+        labels = {"method": method, "endpoint": endpoint}
+        for bound, bucket_count in zip(HTTP_LATENCY_BUCKETS, counts):
+            lines.append(f"{name}_bucket{format_metric_labels({**labels, 'le': bound})} {bucket_count}")
+        lines.append(f"{name}_bucket{format_metric_labels({**labels, 'le': '+Inf'})} {count}")
+        lines.append(f"{name}_sum{format_metric_labels(labels)} {round(total, 6)}")
+        lines.append(f"{name}_count{format_metric_labels(labels)} {count}")
+    
+    return '\n'.join(lines) + '\n'
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus抓取接口，已登录或携带配置中的metrics_token均可访问"""
+    token = config['security'].get('metrics_token')
+    authorized = session.get('logged_in') or (
+        token and request.headers.get('Authorization') == f"Bearer {token}"
+    )
+    if not authorized:
+        return Response('unauthorized\n', status=401, mimetype='text/plain')
+    return Response(render_prometheus_metrics(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+def get_online_players(server_id):
+    """获取服务器在线玩家（读取内存中的跟踪结果）"""
+    process = minecraft_processes.get(server_id)
+    if process is None or process.poll() is not None:
         return []
+    return sorted(online_players.get(server_id, {}))
 
 @app.route('/api/servers/<server_id>/players')
 @login_required
@@ -1420,50 +3834,1040 @@ def get_server_players(server_id):
         "count": len(players)
     })
 
-def create_backup(server_id):
-    """创建服务器备份"""
+@app.route('/api/servers/<server_id>/players/history')
+@login_required
+def get_player_history(server_id):
+    """获取服务器的玩家会话记录"""
+    if server_id not in config["servers"]:
+        return jsonify({"status": "error", "message": "服务器不存在"})
+    limit = min(max(1, int(request.args.get('limit', 100))), 1000)
+    return jsonify({
+        "status": "success",
+        "sessions": state_store.player_sessions(server_id, limit)
+    })
+
+def get_backup_lock(server_id):
+    """同一服务器的备份、删除和清理操作互斥"""
+    with backup_locks_lock:
+        lock = backup_locks.get(server_id)
+        if lock is None:
+            lock = backup_locks[server_id] = threading.Lock()
+        return lock
+
+def iter_backup_files(server_path):
+    """遍历需要备份的文件，返回(完整路径, 以/分隔的相对路径)"""
+    for root, dirs, files in os.walk(server_path):
+        # 排除backups目录和logs目录
+        if 'backups' in dirs:
+            dirs.remove('backups')
+        if 'logs' in dirs:
+            dirs.remove('logs')
+        
+        for file in files:
+            file_path = os.path.join(root, file)
+            yield file_path, os.path.relpath(file_path, server_path).replace(os.sep, '/')
+
+def send_server_command(server_id, command):
+    """向运行中的服务器发送一条控制台命令，服务器未运行时返回False"""
+    process = minecraft_processes.get(server_id)
+    if not process or process.poll() is not None:
+        return False
+    process.stdin.write(command + '\n')
+    process.stdin.flush()
+    return True
+
+def wait_for_log_line(log_file, cursor, pattern, timeout):
+    """从cursor开始等待匹配pattern的日志行，超时返回False"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        result = read_log_since(log_file, cursor) if os.path.exists(log_file) else None
+        if result is None:
+            return False
+        lines, cursor = result
+        for line in lines:
+            if pattern.search(LOG_PREFIX_PATTERN.match(line).group(2)):
+                return True
+        time.sleep(0.2)
+    return False
+
+def clone_file(src, dst):
+    """创建文件的独立副本：优先reflink，文件系统不支持时退回普通复制
+
+    返回使用的方式，用于统计。
+    """
+    if fcntl is not None:
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            shutil.copystat(src, dst)
+            return 'reflink'
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+    return 'copy'
+
+def stage_server_files(server_path, staging_dir, job=None):
+    """把服务器文件快速复制到暂存目录，返回各方式处理的文件数
+
+    区块文件会被服务端原地改写，硬链接会跟着变化，所以只对jar使用硬链接。
+    """
+    counts = {'link': 0, 'reflink': 0, 'copy': 0}
+    for file_path, rel_path in iter_backup_files(server_path):
+        if job:
+            job.update(message=f"正在暂存 {rel_path}")
+        target = os.path.join(staging_dir, rel_path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.splitext(rel_path)[1].lower() in HOT_BACKUP_LINK_EXTENSIONS:
+            try:
+                os.link(file_path, target)
+                counts['link'] += 1
+                continue
+            except OSError:
+                pass
+        counts[clone_file(file_path, target)] += 1
+    return counts
+
+def prepare_hot_backup(server_id, server_path, staging_dir, job=None):
+    """暂停自动保存并刷盘，创建暂存副本后立即恢复保存
+
+    返回(暂停保存的秒数, 暂存统计)。
+    """
+    log_file = os.path.join(server_path, 'logs', 'latest.log')
+    cursor = os.path.getsize(log_file) if os.path.exists(log_file) else 0
+    paused_at = time.time()
+    try:
+        if job:
+            job.update(message="正在暂停自动保存并写入存档")
+        if not send_server_command(server_id, 'save-off') or not send_server_command(server_id, 'save-all flush'):
+            raise Exception("服务器未运行")
+        if not wait_for_log_line(log_file, cursor, SAVE_COMPLETE_PATTERN, HOT_BACKUP_SAVE_TIMEOUT):
+            raise Exception("等待存档保存完成超时")
+        counts = stage_server_files(server_path, staging_dir, job)
+    finally:
+        try:
+            send_server_command(server_id, 'save-on')
+        except Exception as e:
+            print(f"恢复自动保存失败: {str(e)}")
+    return time.time() - paused_at, counts
+
+def create_backup(server_id, mode='zip', job=None, codec='deflate', level=None, hot=False):
+    """创建服务器备份，job用于报告进度和响应取消
+
+    codec和level只对完整备份生效；快照的数据块始终使用zlib。
+    hot为True且服务器正在运行时，先在暂停保存期间创建暂存副本，再从副本压缩。
+    """
     if server_id not in config["servers"]:
         return None, "服务器不存在"
+    if mode not in BACKUP_MODES:
+        return None, f"不支持的备份模式: {mode}"
+    if codec not in BACKUP_CODECS:
+        return None, f"不支持的压缩方式: {codec}"
+    if level is None:
+        level = BACKUP_CODECS[codec]
     
     try:
+        started = time.time()
         server = config["servers"][server_id]
         server_path = server['server_path']
         backup_dir = os.path.join(server_path, 'backups')
         os.makedirs(backup_dir, exist_ok=True)
-        
-        # 生成备份文件名
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_name = f"backup_{timestamp}.zip"
-        backup_path = os.path.join(backup_dir, backup_name)
         
-        # 创建ZIP文件
-        with zipfile.ZipFile(backup_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            # 遍历服务器目录
-            for root, dirs, files in os.walk(server_path):
-                # 排除backups目录和logs目录
-                if 'backups' in dirs:
-                    dirs.remove('backups')
-                if 'logs' in dirs:
-                    dirs.remove('logs')
-                
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    # 计算相对路径
-                    arc_path = os.path.relpath(file_path, server_path)
-                    zipf.write(file_path, arc_path)
+        with get_backup_lock(server_id):
+            source_path = server_path
+            staging_dir = None
+            hot_stats = None
+            process = minecraft_processes.get(server_id)
+            try:
+                if hot and process and process.poll() is None:
+                    # 暂存目录和服务器在同一文件系统上，才能使用硬链接和reflink
+                    staging_dir = os.path.join(backup_dir, f'.staging_{timestamp}')
+                    os.makedirs(staging_dir)
+                    hot_stats = prepare_hot_backup(server_id, server_path, staging_dir, job)
+                    source_path = staging_dir
+                if mode == 'snapshot':
+                    backup_info = create_snapshot(source_path, backup_dir, timestamp, job)
+                elif codec == 'zstd':
+                    backup_info = create_tar_zstd_backup(source_path, backup_dir, timestamp, job, level)
+                else:
+                    backup_info = create_zip_backup(source_path, backup_dir, timestamp, job, codec, level)
+            finally:
+                if staging_dir:
+                    shutil.rmtree(staging_dir, ignore_errors=True)
         
-        # 获取备份文件大小
-        backup_size = os.path.getsize(backup_path) / (1024 * 1024)  # 转换为MB
+        if hot_stats:
+            backup_info['save_pause'] = round(hot_stats[0], 2)
+            backup_info['staging'] = hot_stats[1]
         
-        return {
-            'name': backup_name,
-            'path': backup_path,
-            'size': round(backup_size, 2),
-            'time': timestamp
-        }, None
+        duration = time.time() - started
+        last_backup_stats[server_id] = {
+            'duration': duration,
+            'size_bytes': backup_info.pop('stored_bytes'),
+            'finished_at': time.time()
+        }
+        source_bytes = backup_info.pop('source_bytes')
+        backup_info['duration'] = round(duration, 2)
+        # 吞吐量按读取的原始数据量计算
+        backup_info['throughput'] = round(source_bytes / (1024 * 1024) / duration, 2) if duration > 0 else None
+        try:
+            backup_catalog.add(server_id, backup_info, source_bytes, last_backup_stats[server_id]['size_bytes'])
+        except Exception as e:
+            # 备份文件已经写好，只是索引没记上，下次列表对账时会补录
+            print(f"记录备份索引失败 {backup_info['name']}: {str(e)}")
+            backup_catalog.invalidate(server_id)
+        return backup_info, None
+    except JobCancelled:
+        raise
     except Exception as e:
         return None, str(e)
 
+def report_backup_progress(job, done_bytes, total_bytes, rel_path):
+    if job:
+        job.update(done_bytes / total_bytes * 100 if total_bytes else None, f"正在备份 {rel_path}")
+
+def is_precompressed(path):
+    return os.path.splitext(path)[1].lower() in PRECOMPRESSED_EXTENSIONS
+
+def compress_backup_member(file_path, level):
+    """在子进程中把文件压缩成原始deflate数据，返回(压缩数据, CRC32, 原始大小)"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    crc = 0
+    size = 0
+    parts = []
+    with open(file_path, 'rb') as f:
+        while True:
+            data = f.read(1024 * 1024)
+            if not data:
+                break
+            crc = zlib.crc32(data, crc)
+            size += len(data)
+            parts.append(compressor.compress(data))
+    parts.append(compressor.flush())
+    return b''.join(parts), crc, size
+
+def write_compressed_member(zipf, file_path, arc_path, data, crc, file_size):
+    """把子进程压缩好的数据直接写入zip，不再经过zipfile的压缩器"""
+    zinfo = zipfile.ZipInfo.from_file(file_path, arc_path)
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    zinfo.CRC = crc
+    zinfo.file_size = file_size
+    zinfo.compress_size = len(data)
+    zinfo.header_offset = zipf.fp.tell()
+    zipf.fp.write(zinfo.FileHeader())
+    zipf.fp.write(data)
+    zipf.filelist.append(zinfo)
+    zipf.NameToInfo[zinfo.filename] = zinfo
+    zipf.start_dir = zipf.fp.tell()
+
+def create_compress_pool():
+    """创建压缩进程池，单核或无法创建子进程时返回None，退回串行压缩"""
+    if BACKUP_COMPRESS_WORKERS <= 1:
+        return None
+    try:
+        return ProcessPoolExecutor(max_workers=BACKUP_COMPRESS_WORKERS)
+    except (OSError, NotImplementedError) as e:
+        print(f"创建压缩进程池失败，改为串行压缩: {str(e)}")
+        return None
+
+def list_backup_sources(server_path):
+    files = [(file_path, arc_path, os.path.getsize(file_path)) for file_path, arc_path in iter_backup_files(server_path)]
+    return files, sum(size for _, _, size in files)
+
+def create_zip_backup(server_path, backup_dir, timestamp, job=None, codec='deflate', level=6):
+    """把服务器目录完整打包为zip
+
+    普通文件分发到进程池并行压缩，已压缩格式和超大文件在当前线程处理，
+    写入顺序与文件遍历顺序一致。
+    """
+    backup_name = f"backup_{timestamp}.zip"
+    backup_path = os.path.join(backup_dir, backup_name)
+    files, total_bytes = list_backup_sources(server_path)
+    done_bytes = 0
+    pool = create_compress_pool() if codec == 'deflate' else None
+    pending = deque()
+    
+    def write_pending(limit):
+        """写出已提交的成员，直到排队数量不超过limit"""
+        nonlocal done_bytes
+        while len(pending) > limit:
+            file_path, arc_path, size, future = pending.popleft()
+            report_backup_progress(job, done_bytes, total_bytes, arc_path)
+            if future is not None:
+                write_compressed_member(zipf, file_path, arc_path, *future.result())
+            elif codec == 'store' or is_precompressed(arc_path):
+                zipf.write(file_path, arc_path, compress_type=zipfile.ZIP_STORED)
+            else:
+                zipf.write(file_path, arc_path, compress_type=zipfile.ZIP_DEFLATED, compresslevel=level)
+            done_bytes += size
+    
+    # 创建ZIP文件，写入时同步计算校验和
+    try:
+        with open(backup_path, 'wb') as raw:
+            output = HashingWriter(raw)
+            with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as zipf:
+                for file_path, arc_path, size in files:
+                    future = None
+                    if pool and 0 < size <= BACKUP_PARALLEL_MAX_MEMBER and not is_precompressed(arc_path):
+                        future = pool.submit(compress_backup_member, file_path, level)
+                    pending.append((file_path, arc_path, size, future))
+                    # 限制在途数量，控制内存占用
+                    write_pending(BACKUP_COMPRESS_WORKERS * 2)
+                write_pending(0)
+    except BaseException:
+        # 取消、磁盘写满或工作进程出错时都删除不完整的压缩包，避免被索引当作有效备份
+        if os.path.exists(backup_path):
+            os.remove(backup_path)
+        raise
+    finally:
+        if pool:
+            pool.shutdown(wait=False)
+    
+    # 获取备份文件大小
+    backup_bytes = os.path.getsize(backup_path)
+    return {
+        'name': backup_name,
+        'path': backup_path,
+        'size': round(backup_bytes / (1024 * 1024), 2),  # 转换为MB
+        'time': timestamp,
+        'type': 'zip',
+        'codec': codec,
+        'file_count': len(files),
+        'checksum': output.hexdigest(),
+        'stored_bytes': backup_bytes,
+        'source_bytes': total_bytes
+    }
+
+def create_tar_zstd_backup(server_path, backup_dir, timestamp, job=None, level=3):
+    """打包为tar并用多线程zstd压缩
+
+    优先使用zstandard模块，没有安装时调用系统中的zstd命令。
+    """
+    backup_name = f"backup_{timestamp}.tar.zst"
+    backup_path = os.path.join(backup_dir, backup_name)
+    files, total_bytes = list_backup_sources(server_path)
+    done_bytes = 0
+    zstd_path = which('zstd')
+    if zstandard is None and not zstd_path:
+        raise Exception("zstd压缩需要安装zstandard模块或zstd命令")
+    
+    process = None
+    copier = None
+    copy_errors = []
+    target = HashingWriter(open(backup_path, 'wb'))
+    
+    def copy_output():
+        """把zstd命令的输出写入备份文件，出错时关闭管道让zstd退出"""
+        try:
+            shutil.copyfileobj(process.stdout, target)
+        except Exception as e:
+            copy_errors.append(e)
+        finally:
+            process.stdout.close()
+    
+    try:
+        if zstandard is not None:
+            output = zstandard.ZstdCompressor(level=level, threads=-1).stream_writer(target)
+        else:
+            # 压缩结果经管道读回，这样写入时也能计算校验和
+            process = subprocess.Popen(
+                [zstd_path, '-q', '-T0', f'-{level}', '-c'],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE
+            )
+            copier = threading.Thread(target=copy_output, daemon=True)
+            copier.start()
+            output = process.stdin
+        with output, tarfile.open(fileobj=output, mode='w|') as tar:
+            for file_path, arc_path, size in files:
+                report_backup_progress(job, done_bytes, total_bytes, arc_path)
+                tar.add(file_path, arcname=arc_path, recursive=False)
+                done_bytes += size
+        if process:
+            copier.join()
+            if copy_errors:
+                raise copy_errors[0]
+            if process.wait() != 0:
+                raise Exception(f"zstd压缩失败，退出码 {process.returncode}")
+    except BaseException:
+        if process and process.poll() is None:
+            process.kill()
+        if copier:
+            copier.join()
+        target.close()
+        if os.path.exists(backup_path):
+            os.remove(backup_path)
+        raise
+    target.close()
+    
+    backup_bytes = os.path.getsize(backup_path)
+    return {
+        'name': backup_name,
+        'path': backup_path,
+        'size': round(backup_bytes / (1024 * 1024), 2),  # 转换为MB
+        'time': timestamp,
+        'type': 'tar.zst',
+        'codec': 'zstd',
+        'file_count': len(files),
+        'checksum': target.hexdigest(),
+        'stored_bytes': backup_bytes,
+        'source_bytes': total_bytes
+    }
+
+def snapshot_chunk_path(backup_dir, digest):
+    return os.path.join(backup_dir, 'chunks', digest[:2], digest)
+
+def store_snapshot_chunk(backup_dir, data, compress=True):
+    """按SHA-256保存数据块，已存在时直接复用，返回(摘要, 新写入的字节数)"""
+    digest = hashlib.sha256(data).hexdigest()
+    path = snapshot_chunk_path(backup_dir, digest)
+    if os.path.exists(path):
+        return digest, 0
+    compressed = zlib.compress(data, SNAPSHOT_COMPRESS_LEVEL) if compress else data
+    # 第一个字节标记是否压缩，已压缩过的数据（如区块文件）原样保存
+    payload = b'Z' + compressed if len(compressed) < len(data) else b'R' + data
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(payload)
+    os.replace(temp_path, path)
+    return digest, len(payload)
+
+def read_snapshot_chunk(backup_dir, digest):
+    with open(snapshot_chunk_path(backup_dir, digest), 'rb') as f:
+        payload = f.read()
+    return zlib.decompress(payload[1:]) if payload[:1] == b'Z' else payload[1:]
+
+def read_snapshot_manifest(manifest_path, with_files=True):
+    """读取快照清单，第一行是摘要，第二行是文件表；列表时只需要读第一行"""
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        summary = json.loads(f.readline())
+        if with_files:
+            summary['files'] = json.loads(f.readline())
+    return summary
+
+def list_snapshot_names(backup_dir):
+    if not os.path.exists(backup_dir):
+        return []
+    return sorted(name for name in os.listdir(backup_dir)
+                  if name.startswith('snapshot_') and name.endswith('.manifest'))
+
+def create_snapshot(server_path, backup_dir, timestamp, job=None):
+    """创建增量快照
+
+    大小和修改时间都没变的文件直接沿用上一个快照的数据块，不再读取和计算哈希；
+    变化的文件按固定大小切块，只有内容不同的块才会写入块存储。
+    """
+    snapshots = list_snapshot_names(backup_dir)
+    previous = {}
+    if snapshots:
+        previous = read_snapshot_manifest(os.path.join(backup_dir, snapshots[-1]))['files']
+    
+    files = {}
+    total_size = 0
+    added_bytes = 0
+    reused_files = 0
+    entries = [(file_path, rel_path, os.stat(file_path)) for file_path, rel_path in iter_backup_files(server_path)]
+    total_bytes = sum(stat.st_size for _, _, stat in entries)
+    # 取消时已写入的数据块不被任何清单引用，会在下次清理时删除
+    for file_path, rel_path, stat in entries:
+        report_backup_progress(job, total_size, total_bytes, rel_path)
+        old = previous.get(rel_path)
+        if old and old['size'] == stat.st_size and old['mtime_ns'] == stat.st_mtime_ns:
+            files[rel_path] = old
+            reused_files += 1
+        else:
+            chunks = []
+            size = 0
+            compress = not is_precompressed(rel_path)
+            with open(file_path, 'rb') as f:
+                while True:
+                    data = f.read(SNAPSHOT_CHUNK_SIZE)
+                    if not data:
+                        break
+                    digest, stored = store_snapshot_chunk(backup_dir, data, compress)
+                    chunks.append(digest)
+                    added_bytes += stored
+                    size += len(data)
+            # 记录读取前的修改时间，读取期间被修改的文件下次会重新计算
+            files[rel_path] = {'size': size, 'mtime_ns': stat.st_mtime_ns, 'chunks': chunks}
+        total_size += files[rel_path]['size']
+    
+    backup_name = f"snapshot_{timestamp}.manifest"
+    manifest_path = os.path.join(backup_dir, backup_name)
+    summary = {
+        'version': 1,
+        'type': 'snapshot',
+        'time': timestamp,
+        'total_size': total_size,
+        'added_size': added_bytes,
+        'file_count': len(files),
+        'reused_files': reused_files
+    }
+    temp_path = manifest_path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(summary, ensure_ascii=False) + '\n')
+        f.write(json.dumps(files, ensure_ascii=False) + '\n')
+    os.replace(temp_path, manifest_path)
+    
+    return {
+        'name': backup_name,
+        'path': manifest_path,
+        'size': round(total_size / (1024 * 1024), 2),  # 转换为MB
+        'added_size': round(added_bytes / (1024 * 1024), 2),
+        'file_count': len(files),
+        'time': timestamp,
+        'type': 'snapshot',
+        'checksum': hash_file(manifest_path),  # 清单文件很小，直接读回计算
+        'stored_bytes': added_bytes,
+        'source_bytes': total_size
+    }
+
+def collect_snapshot_garbage(backup_dir):
+    """删除不再被任何快照引用的数据块，调用方需持有备份锁"""
+    chunk_root = os.path.join(backup_dir, 'chunks')
+    if not os.path.exists(chunk_root):
+        return 0
+    referenced = set()
+    for name in list_snapshot_names(backup_dir):
+        for entry in read_snapshot_manifest(os.path.join(backup_dir, name))['files'].values():
+            referenced.update(entry['chunks'])
+    removed = 0
+    for prefix in os.listdir(chunk_root):
+        prefix_dir = os.path.join(chunk_root, prefix)
+        for digest in os.listdir(prefix_dir):
+            if digest not in referenced:
+                os.remove(os.path.join(prefix_dir, digest))
+                removed += 1
+        if not os.listdir(prefix_dir):
+            os.rmdir(prefix_dir)
+    return removed
+
+def is_backup_name(name):
+    return (name.startswith('backup_') and name.endswith(('.zip', '.tar.zst'))) or \
+           (name.startswith('snapshot_') and name.endswith('.manifest'))
+
+def hash_file(path, algorithm='sha256'):
+    """计算文件的摘要，默认SHA-256"""
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(1024 * 1024)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+class HashingWriter:
+    """包装输出文件，写入时同步计算摘要，省去写完后再读一遍
+
+    不提供seek，zipfile会改为在数据后写描述符，不会回头改写文件头。
+    """
+    def __init__(self, f, algorithm='sha256'):
+        self.f = f
+        self.digest = hashlib.new(algorithm)
+        self.offset = 0
+
+    def write(self, data):
+        self.digest.update(data)
+        self.offset += len(data)
+        return self.f.write(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+def scan_backup_file(backup_dir, name):
+    """从磁盘读取单个备份的信息，用于把目录中已有但未入库的备份补进索引"""
+    file_path = os.path.join(backup_dir, name)
+    if name.startswith('snapshot_'):
+        summary = read_snapshot_manifest(file_path, with_files=False)
+        return {
+            'name': name,
+            'type': 'snapshot',
+            'codec': 'zlib',
+            'time': summary['time'],
+            'size_bytes': summary['total_size'],
+            'added_bytes': summary['added_size'],
+            'file_count': summary['file_count']
+        }
+    size = os.path.getsize(file_path)
+    return {
+        'name': name,
+        'type': 'zip' if name.endswith('.zip') else 'tar.zst',
+        'codec': None,
+        'time': name[7:7 + 15],  # 从文件名提取时间戳
+        'size_bytes': size,
+        'added_bytes': size,
+        'file_count': None
+    }
+
+class BackupCatalog:
+    """备份索引，所有服务器共用一个SQLite库
+
+    每个服务器在进程内第一次访问时和备份目录对账一次，之后列表、分页和保留策略都只查索引。
+    """
+    COLUMNS = ('name', 'type', 'codec', 'time', 'size_bytes', 'added_bytes',
+               'file_count', 'duration', 'checksum', 'source_bytes', 'created_at')
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = None
+        self.synced = set()
+
+    def connect(self):
+        if self.conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.row_factory = sqlite3.Row
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS backups (
+                    server_id TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    type TEXT NOT NULL,
+                    codec TEXT,
+                    time TEXT NOT NULL,
+                    size_bytes INTEGER NOT NULL,
+                    added_bytes INTEGER,
+                    file_count INTEGER,
+                    duration REAL,
+                    checksum TEXT,
+                    source_bytes INTEGER,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (server_id, name)
+                )
+            """)
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_backups_time ON backups (server_id, time)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_backups_size ON backups (server_id, size_bytes)')
+            self.conn.commit()
+        return self.conn
+
+    def insert(self, server_id, row):
+        values = [row.get(column) for column in self.COLUMNS]
+        self.connect().execute(
+            f"INSERT OR REPLACE INTO backups (server_id, {', '.join(self.COLUMNS)}) "
+            f"VALUES (?, {', '.join('?' * len(self.COLUMNS))})",
+            [server_id] + values
+        )
+
+    def add(self, server_id, backup_info, source_bytes=None, stored_bytes=None):
+        """记录新创建的备份"""
+        row = {
+            'name': backup_info['name'],
+            'type': backup_info['type'],
+            'codec': backup_info.get('codec', 'zlib' if backup_info['type'] == 'snapshot' else None),
+            'time': backup_info['time'],
+            'size_bytes': source_bytes if backup_info['type'] == 'snapshot' else os.path.getsize(backup_info['path']),
+            'added_bytes': stored_bytes,
+            'file_count': backup_info.get('file_count'),
+            'duration': backup_info.get('duration'),
+            'checksum': backup_info.get('checksum'),
+            'source_bytes': source_bytes,
+            'created_at': time.time()
+        }
+        with self.lock:
+            self.insert(server_id, row)
+            self.conn.commit()
+
+    def remove(self, server_id, names):
+        with self.lock:
+            self.connect().executemany(
+                'DELETE FROM backups WHERE server_id = ? AND name = ?',
+                [(server_id, name) for name in names]
+            )
+            self.conn.commit()
+
+    def invalidate(self, server_id):
+        """下次访问时重新和备份目录对账"""
+        with self.lock:
+            self.synced.discard(server_id)
+
+    def remove_server(self, server_id):
+        with self.lock:
+            self.connect().execute('DELETE FROM backups WHERE server_id = ?', (server_id,))
+            self.conn.commit()
+            self.synced.discard(server_id)
+
+    def sync(self, server_id, backup_dir):
+        """和备份目录对账：补录目录中新出现的备份，删除已不存在的记录"""
+        if server_id in self.synced:
+            return
+        names = set()
+        if os.path.exists(backup_dir):
+            names = {name for name in os.listdir(backup_dir) if is_backup_name(name)}
+        with self.lock:
+            conn = self.connect()
+            known = {row['name'] for row in conn.execute(
+                'SELECT name FROM backups WHERE server_id = ?', (server_id,))}
+            for name in names - known:
+                try:
+                    row = scan_backup_file(backup_dir, name)
+                except Exception as e:
+                    print(f"读取备份信息失败 {name}: {str(e)}")
+                    continue
+                row['created_at'] = time.time()
+                self.insert(server_id, row)
+            conn.executemany(
+                'DELETE FROM backups WHERE server_id = ? AND name = ?',
+                [(server_id, name) for name in known - names]
+            )
+            conn.commit()
+            self.synced.add(server_id)
+
+    def query(self, server_id, offset=0, limit=None, sort='time', descending=True):
+        """分页查询，返回(备份列表, 总数)"""
+        column = BACKUP_SORT_FIELDS.get(sort, 'time')
+        direction = 'DESC' if descending else 'ASC'
+        with self.lock:
+            conn = self.connect()
+            total = conn.execute('SELECT COUNT(*) FROM backups WHERE server_id = ?', (server_id,)).fetchone()[0]
+            rows = conn.execute(
+                f'SELECT * FROM backups WHERE server_id = ? ORDER BY {column} {direction}, name {direction} '
+                'LIMIT ? OFFSET ?',
+                (server_id, -1 if limit is None else limit, offset)
+            ).fetchall()
+        return [dict(row) for row in rows], total
+
+    def expired(self, server_id, keep):
+        """按时间倒序保留keep个备份，返回其余备份的名称"""
+        with self.lock:
+            rows = self.connect().execute(
+                'SELECT name FROM backups WHERE server_id = ? ORDER BY time DESC, name DESC LIMIT -1 OFFSET ?',
+                (server_id, keep)
+            ).fetchall()
+        return [row['name'] for row in rows]
+
+backup_catalog = BackupCatalog(BACKUP_CATALOG_FILE)
+
+def list_backup_entries(server_id, offset=0, limit=None, sort='time', descending=True):
+    """从索引中分页列出备份，返回(备份列表, 总数)"""
+    server = config["servers"][server_id]
+    backup_catalog.sync(server_id, os.path.join(server['server_path'], 'backups'))
+    rows, total = backup_catalog.query(server_id, offset, limit, sort, descending)
+    backups = []
+    for row in rows:
+        entry = {
+            'name': row['name'],
+            'type': row['type'],
+            'codec': row['codec'],
+            'time': row['time'],
+            'size': round(row['size_bytes'] / (1024 * 1024), 2),  # 转换为MB
+            'file_count': row['file_count'],
+            'duration': row['duration'],
+            'checksum': row['checksum']
+        }
+        if row['type'] == 'snapshot' and row['added_bytes'] is not None:
+            entry['added_size'] = round(row['added_bytes'] / (1024 * 1024), 2)
+        backups.append(entry)
+    return backups, total
+
+def remove_backups(server_id, names):
+    """删除若干备份，删除快照后清理无人引用的数据块"""
+    server = config["servers"][server_id]
+    backup_dir = os.path.join(server['server_path'], 'backups')
+    with get_backup_lock(server_id):
+        removed_snapshot = False
+        try:
+            for name in names:
+                path = os.path.join(backup_dir, name)
+                if os.path.exists(path):
+                    os.remove(path)
+                removed_snapshot = removed_snapshot or name.startswith('snapshot_')
+        finally:
+            backup_catalog.remove(server_id, names)
+        if removed_snapshot:
+            collect_snapshot_garbage(backup_dir)
+
+class ZipStreamBuffer:
+    """只写缓冲区，让zipfile以不可寻址的流方式生成压缩包"""
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+def file_etag(path):
+    """由inode、大小和修改时间生成强ETag，文件被改写或替换后随之变化"""
+    stat = os.stat(path)
+    return hashlib.sha1(f"{stat.st_ino}-{stat.st_size}-{stat.st_mtime_ns}".encode()).hexdigest()
+
+def send_download(path, download_name):
+    """发送文件，支持Range和If-Range断点续传及分段并行下载
+
+    整文件发送时交给WSGI服务器的file_wrapper（可用时为sendfile），
+    开启use_x_sendfile后由前端的nginx/Apache直接发送。
+    """
+    response = send_file(
+        path,
+        as_attachment=True,
+        download_name=download_name,
+        conditional=True,
+        etag=file_etag(path),
+        max_age=0
+    )
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
+def attachment_header(filename):
+    return f"attachment; filename*=UTF-8''{quote(filename)}"
+
+def stream_directory_zip(dir_path):
+    """把目录边读边打包成zip输出，不生成临时文件"""
+    buffer = ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        for root, dirs, files in os.walk(dir_path):
+            dirs.sort()
+            for file in sorted(files):
+                file_path = os.path.join(root, file)
+                arc_path = os.path.relpath(file_path, dir_path).replace(os.sep, '/')
+                info = zipfile.ZipInfo.from_file(file_path, arc_path)
+                info.compress_type = zipfile.ZIP_STORED if is_precompressed(arc_path) else zipfile.ZIP_DEFLATED
+                with open(file_path, 'rb') as src, zipf.open(info, 'w', force_zip64=True) as dest:
+                    while True:
+                        data = src.read(1024 * 1024)
+                        if not data:
+                            break
+                        dest.write(data)
+                        yield buffer.drain()
+                yield buffer.drain()
+    yield buffer.drain()
+
+def stream_snapshot_zip(backup_dir, manifest):
+    """把快照边读取数据块边打包成zip输出，不生成临时文件"""
+    buffer = ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        for rel_path, entry in manifest['files'].items():
+            date_time = max(time.localtime(entry['mtime_ns'] / 1e9)[:6], (1980, 1, 1, 0, 0, 0))
+            info = zipfile.ZipInfo(rel_path, date_time=date_time)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with zipf.open(info, 'w', force_zip64=True) as dest:
+                for digest in entry['chunks']:
+                    dest.write(read_snapshot_chunk(backup_dir, digest))
+                    yield buffer.drain()
+            yield buffer.drain()
+    yield buffer.drain()
+
+def normalize_restore_paths(paths):
+    """规范化要恢复的路径，空列表表示恢复全部"""
+    result = []
+    for path in paths or []:
+        path = str(path).replace('\\', '/').strip('/')
+        if not path:
+            continue
+        if '..' in path.split('/'):
+            raise Exception(f"非法路径: {path}")
+        result.append(path)
+    return result
+
+def is_restore_selected(rel_path, paths):
+    return not paths or any(rel_path == path or rel_path.startswith(path + '/') for path in paths)
+
+def file_crc32(path):
+    crc = 0
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(RESTORE_BLOCK_SIZE)
+            if not data:
+                return crc
+            crc = zlib.crc32(data, crc)
+
+def file_matches_chunks(path, chunks):
+    """按快照的分块方式计算磁盘文件的哈希，与快照记录一致时返回True"""
+    with open(path, 'rb') as f:
+        for digest in chunks:
+            if hashlib.sha256(f.read(SNAPSHOT_CHUNK_SIZE)).hexdigest() != digest:
+                return False
+        return not f.read(1)
+
+def restore_file(target, blocks, size, mtime):
+    """把数据块写入target，返回是否实际写入
+
+    磁盘上已有同样大小的文件时边读边比较，内容完全一致就不写；
+    出现第一处不同后，相同的前半部分直接从磁盘复制，之后改用备份中的数据。
+    """
+    existing = open(target, 'rb') if os.path.isfile(target) and os.path.getsize(target) == size else None
+    temp_path = target + RESTORE_TEMP_SUFFIX
+    out = None
+    offset = 0
+    try:
+        for data in blocks:
+            if out is None and existing is not None:
+                if existing.read(len(data)) == data:
+                    offset += len(data)
+                    continue
+                out = open(temp_path, 'wb')
+                existing.seek(0)
+                remaining = offset
+                while remaining:
+                    chunk = existing.read(min(RESTORE_BLOCK_SIZE, remaining))
+                    out.write(chunk)
+                    remaining -= len(chunk)
+            if out is None:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                out = open(temp_path, 'wb')
+            out.write(data)
+        if out is None:
+            if existing is not None:
+                return False
+            # 空文件
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            out = open(temp_path, 'wb')
+        out.close()
+        os.replace(temp_path, target)
+        os.utime(target, (mtime, mtime))
+        return True
+    except BaseException:
+        if out is not None:
+            out.close()
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    finally:
+        if existing is not None:
+            existing.close()
+
+def iter_file_blocks(f):
+    while True:
+        data = f.read(RESTORE_BLOCK_SIZE)
+        if not data:
+            return
+        yield data
+
+def open_zstd_stream(path):
+    """打开tar.zst的解压流，返回(可读流, 解压子进程或None)"""
+    if zstandard is not None:
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb')), None
+    zstd_path = which('zstd')
+    if not zstd_path:
+        raise Exception("恢复tar.zst备份需要安装zstandard模块或zstd命令")
+    process = subprocess.Popen([zstd_path, '-d', '-c', '-q', path], stdout=subprocess.PIPE)
+    return process.stdout, process
+
+class RestoreProgress:
+    """统计恢复结果并报告进度"""
+    def __init__(self, job, total_bytes):
+        self.job = job
+        self.total_bytes = total_bytes
+        self.done_bytes = 0
+        self.restored = 0
+        self.skipped = 0
+        self.written_bytes = 0
+
+    def begin(self, rel_path):
+        progress = self.done_bytes / self.total_bytes * 100 if self.total_bytes else None
+        self.job.update(progress, f"正在恢复 {rel_path}")
+
+    def finish(self, size, written):
+        self.done_bytes += size
+        if written:
+            self.restored += 1
+            self.written_bytes += size
+        else:
+            self.skipped += 1
+
+    def result(self):
+        return {
+            "restored": self.restored,
+            "skipped": self.skipped,
+            "written_mb": round(self.written_bytes / (1024 * 1024), 2)
+        }
+
+def restore_target(server_path, rel_path):
+    target = os.path.join(server_path, rel_path)
+    if not is_within_directory(server_path, target):
+        raise Exception(f"备份包含非法路径: {rel_path}")
+    return target
+
+def restore_zip(job, backup_path, server_path, paths):
+    with zipfile.ZipFile(backup_path) as archive:
+        members = [info for info in archive.infolist()
+                   if not info.is_dir() and is_restore_selected(info.filename, paths)]
+        progress = RestoreProgress(job, sum(info.file_size for info in members))
+        for info in members:
+            progress.begin(info.filename)
+            target = restore_target(server_path, info.filename)
+            # zip记录了CRC，大小和CRC都一致时无需解压
+            if os.path.isfile(target) and os.path.getsize(target) == info.file_size and \
+               file_crc32(target) == info.CRC:
+                progress.finish(info.file_size, False)
+                continue
+            mtime = time.mktime(info.date_time + (0, 0, -1))
+            with archive.open(info) as src:
+                written = restore_file(target, iter_file_blocks(src), info.file_size, mtime)
+            progress.finish(info.file_size, written)
+    return progress.result()
+
+def restore_tar_zstd(job, backup_path, server_path, paths):
+    stream, process = open_zstd_stream(backup_path)
+    progress = RestoreProgress(job, None)
+    try:
+        with stream, tarfile.open(fileobj=stream, mode='r|') as archive:
+            for member in archive:
+                # 兼容用tar -C dir .手工打包的备份
+                rel_path = member.name[2:] if member.name.startswith('./') else member.name
+                if not member.isfile() or not is_restore_selected(rel_path, paths):
+                    continue
+                progress.begin(rel_path)
+                target = restore_target(server_path, rel_path)
+                written = restore_file(target, iter_file_blocks(archive.extractfile(member)), member.size, member.mtime)
+                progress.finish(member.size, written)
+    finally:
+        if process:
+            process.kill()
+            process.wait()
+    return progress.result()
+
+def restore_snapshot(job, backup_dir, manifest_path, server_path, paths):
+    files = read_snapshot_manifest(manifest_path)['files']
+    selected = [(rel_path, entry) for rel_path, entry in files.items() if is_restore_selected(rel_path, paths)]
+    progress = RestoreProgress(job, sum(entry['size'] for _, entry in selected))
+    for rel_path, entry in selected:
+        progress.begin(rel_path)
+        target = restore_target(server_path, rel_path)
+        if os.path.isfile(target) and os.path.getsize(target) == entry['size'] and \
+           file_matches_chunks(target, entry['chunks']):
+            progress.finish(entry['size'], False)
+            continue
+        blocks = (read_snapshot_chunk(backup_dir, digest) for digest in entry['chunks'])
+        written = restore_file(target, blocks, entry['size'], entry['mtime_ns'] / 1e9)
+        progress.finish(entry['size'], written)
+    return progress.result()
+
+def run_restore_job(job, server_id, backup_name, paths):
+    """从备份恢复服务器文件，只写入和磁盘内容不同的文件"""
+    process = minecraft_processes.get(server_id)
+    if process and process.poll() is None:
+        raise Exception("请先停止服务器")
+    server = config["servers"][server_id]
+    server_path = server['server_path']
+    backup_dir = os.path.join(server_path, 'backups')
+    backup_path = os.path.join(backup_dir, backup_name)
+    # 持有备份锁，防止恢复过程中快照数据块被清理
+    with get_backup_lock(server_id):
+        if backup_name.startswith('snapshot_'):
+            return restore_snapshot(job, backup_dir, backup_path, server_path, paths)
+        if backup_name.endswith('.tar.zst'):
+            return restore_tar_zstd(job, backup_path, server_path, paths)
+        return restore_zip(job, backup_path, server_path, paths)
+
 @app.route('/api/servers/<server_id>/backup', methods=['POST'])
 @login_required
 def backup_server(server_id):
@@ -1471,17 +4875,27 @@ def backup_server(server_id):
     if server_id not in config["servers"]:
         return jsonify({"status": "error", "message": "服务器不存在"})
     
-    backup_info, error = create_backup(server_id)
+    data = request.get_json(silent=True) or {}
+    mode = data.get('mode', 'zip')
+    codec = data.get('codec', 'deflate')
+    level = data.get('level')
+    if mode not in BACKUP_MODES:
+        return jsonify({"status": "error", "message": f"不支持的备份模式: {mode}"})
+    if codec not in BACKUP_CODECS:
+        return jsonify({"status": "error", "message": f"不支持的压缩方式: {codec}"})
+    level, error = parse_backup_level(codec, level)
     if error:
-        return jsonify({
-            "status": "error",
-            "message": f"创建备份失败: {error}"
-        })
+        return jsonify({"status": "error", "message": error})
+    hot = bool(data.get('hot', False))
     
+    job = job_manager.submit(
+        'backup', server_id, lambda job: run_backup_job(job, server_id, mode, 0, codec, level, hot),
+        f"手动备份 ({mode if mode == 'snapshot' else codec})"
+    )
     return jsonify({
         "status": "success",
-        "message": "备份创建成功",
-        "backup": backup_info
+        "message": "备份任务已提交",
+        "job_id": job.id
     })
 
 @app.route('/api/servers/<server_id>/backups')
@@ -1492,28 +4906,12 @@ def list_backups(server_id):
         return jsonify({"status": "error", "message": "服务器不存在"})
     
     try:
-        server = config["servers"][server_id]
-        backup_dir = os.path.join(server['server_path'], 'backups')
-        if not os.path.exists(backup_dir):
-            return jsonify({"backups": []})
-        
-        backups = []
-        for file in os.listdir(backup_dir):
-            if file.startswith('backup_') and file.endswith('.zip'):
-                file_path = os.path.join(backup_dir, file)
-                file_size = os.path.getsize(file_path) / (1024 * 1024)  # 转换为MB
-                file_time = file[7:-4]  # 从文件名提取时间戳
-                
-                backups.append({
-                    'name': file,
-                    'path': file_path,
-                    'size': round(file_size, 2),
-                    'time': file_time
-                })
-        
-        # 按时间倒序排序
-        backups.sort(key=lambda x: x['time'], reverse=True)
-        return jsonify({"backups": backups})
+        offset = max(0, request.args.get('offset', 0, type=int))
+        limit = request.args.get('limit', type=int)
+        sort = request.args.get('sort', 'time')
+        descending = request.args.get('order', 'desc') != 'asc'
+        backups, total = list_backup_entries(server_id, offset, limit, sort, descending)
+        return jsonify({"backups": backups, "total": total})
     
     except Exception as e:
         return jsonify({
@@ -1533,14 +4931,20 @@ def download_backup(server_id, backup_name):
         backup_dir = os.path.join(server['server_path'], 'backups')
         backup_path = os.path.join(backup_dir, backup_name)
         
-        if not os.path.exists(backup_path):
+        if not is_backup_name(backup_name) or not os.path.exists(backup_path):
             return jsonify({"status": "error", "message": "备份文件不存在"})
         
-        return send_from_directory(
-            backup_dir,
-            backup_name,
-            as_attachment=True
-        )
+        if backup_name.startswith('snapshot_'):
+            # 快照没有现成的压缩包，边读边打包
+            manifest = read_snapshot_manifest(backup_path)
+            zip_name = backup_name[:-len('.manifest')] + '.zip'
+            return Response(
+                stream_snapshot_zip(backup_dir, manifest),
+                mimetype='application/zip',
+                headers={'Content-Disposition': f'attachment; filename="{zip_name}"'}
+            )
+        
+        return send_download(backup_path, backup_name)
     except Exception as e:
         return jsonify({
             "status": "error",
@@ -1559,10 +4963,10 @@ def delete_backup(server_id, backup_name):
         backup_dir = os.path.join(server['server_path'], 'backups')
         backup_path = os.path.join(backup_dir, backup_name)
         
-        if not os.path.exists(backup_path):
+        if not is_backup_name(backup_name) or not os.path.exists(backup_path):
             return jsonify({"status": "error", "message": "备份文件不存在"})
         
-        os.remove(backup_path)
+        remove_backups(server_id, [backup_name])
         return jsonify({"status": "success"})
     except Exception as e:
         return jsonify({
@@ -1570,6 +4974,32 @@ def delete_backup(server_id, backup_name):
             "message": f"删除备份失败: {str(e)}"
         })
 
+@app.route('/api/servers/<server_id>/backups/<backup_name>/restore', methods=['POST'])
+@login_required
+def restore_backup(server_id, backup_name):
+    """从备份恢复，可只恢复指定的文件或目录，在后台任务中执行"""
+    if server_id not in config["servers"]:
+        return jsonify({"status": "error", "message": "服务器不存在"})
+    if server_id in minecraft_processes and minecraft_processes[server_id].poll() is None:
+        return jsonify({"status": "error", "message": "请先停止服务器"})
+    
+    server = config["servers"][server_id]
+    backup_path = os.path.join(server['server_path'], 'backups', backup_name)
+    if not is_backup_name(backup_name) or not os.path.exists(backup_path):
+        return jsonify({"status": "error", "message": "备份文件不存在"})
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        paths = normalize_restore_paths(data.get('paths'))
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)})
+    
+    job = job_manager.submit(
+        'restore', server_id, lambda job: run_restore_job(job, server_id, backup_name, paths),
+        f"从 {backup_name} 恢复" + (f"（{', '.join(paths)}）" if paths else ''), pool='backup'
+    )
+    return jsonify({"status": "success", "job_id": job.id})
+
 @app.route('/api/files/<server_id>/create_folder', methods=['POST'])
 @login_required
 def create_folder(server_id):
@@ -1719,10 +5149,26 @@ def frp():
 
 if __name__ == '__main__':
     config = load_config()
+    rebuild_log_translator()
+    app.config['USE_X_SENDFILE'] = bool(config.get('use_x_sendfile'))
+    job_manager.configure_pool('download', max(1, int(config.get('download_workers', JOB_POOLS['download']))))
     app.secret_key = config['security']['secret_key']
     app.permanent_session_lifetime = timedelta(seconds=config['security']['login_timeout'])
     
-    # 启动调度器
-    scheduler.start()
+    debug = True
+    # 调试模式下reloader的父进程只负责监视文件变化，后台工作只在实际提供服务的子进程中启动，
+    # 否则定时任务会执行两次，重启任务还会在父进程中再启动一个服务器
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        # 恢复状态库中的定时任务，面板重启前未完成的后台任务和玩家会话标记结束
+        state_store.mark_interrupted_jobs()
+        state_store.close_all_sessions()
+        restore_scheduled_tasks()
+        
+        # 启动调度器
+        scheduler.start()
+        
+        # 启动资源采样和在线玩家跟踪线程
+        threading.Thread(target=resource_sampler_thread, daemon=True).start()
+        threading.Thread(target=player_tracker_thread, daemon=True).start()
     
-    app.run(host='0.0.0.0', port=config["web_port"], debug=True) 
+    app.run(host='0.0.0.0', port=config["web_port"], debug=debug) 
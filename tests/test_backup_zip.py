@@ -0,0 +1,46 @@
+import os
+import zipfile
+
+import app
+
+
+def make_server(tmp_path):
+    server = tmp_path / 'server'
+    (server / 'world' / 'region').mkdir(parents=True)
+    (server / 'logs').mkdir()
+    (server / 'server.properties').write_text('motd=test\n' * 200, encoding='utf-8')
+    (server / 'world' / 'level.dat').write_bytes(os.urandom(4096))
+    (server / 'world' / 'region' / 'r.0.0.mca').write_bytes(os.urandom(50000))
+    (server / 'world' / 'empty.txt').write_bytes(b'')
+    (server / 'plugins.yml').write_text('plugin: value\n' * 50000, encoding='utf-8')
+    (server / 'logs' / 'latest.log').write_text('skipped', encoding='utf-8')
+    return server
+
+
+def test_parallel_zip_backup_round_trip(tmp_path, monkeypatch):
+    # 确保走进程池写入预压缩成员，同时让较大的文件留在当前线程压缩
+    monkeypatch.setattr(app, 'BACKUP_COMPRESS_WORKERS', 2)
+    monkeypatch.setattr(app, 'BACKUP_PARALLEL_MAX_MEMBER', 100000)
+    server = make_server(tmp_path)
+    backup_dir = tmp_path / 'backups'
+    backup_dir.mkdir()
+    written = []
+    original = app.write_compressed_member
+    monkeypatch.setattr(app, 'write_compressed_member',
+                        lambda zipf, file_path, arc_path, *args: written.append(arc_path) or
+                        original(zipf, file_path, arc_path, *args))
+
+    info = app.create_zip_backup(str(server), str(backup_dir), 'test', codec='deflate', level=6)
+
+    with zipfile.ZipFile(info['path']) as archive:
+        assert archive.testzip() is None
+        names = sorted(archive.namelist())
+        assert names == sorted(['server.properties', 'world/level.dat', 'world/region/r.0.0.mca',
+                                'world/empty.txt', 'plugins.yml'])
+        for name in names:
+            assert archive.read(name) == (server / name).read_bytes()
+        assert archive.getinfo('server.properties').compress_type == zipfile.ZIP_DEFLATED
+        assert archive.getinfo('world/region/r.0.0.mca').compress_type == zipfile.ZIP_STORED
+    assert info['file_count'] == 5
+    assert info['checksum'] == app.hash_file(info['path'])
+    assert 'server.properties' in written and 'plugins.yml' not in written
@@ -0,0 +1,42 @@
+import app
+
+
+def message(line):
+    return app.LOG_PREFIX_PATTERN.match(line).group(2)
+
+
+def test_prefix_stripped_for_vanilla_paper_and_forge():
+    assert message('[12:00:00] [Server thread/INFO]: Done (3.2s)! For help, type "help"').startswith('Done')
+    assert message('[12:00:00 INFO]: Done (5.1s)! For help, type "help"').startswith('Done')
+    assert message('[12:00:00] [Server thread/INFO] [minecraft/DedicatedServer]: Done (9.0s)!').startswith('Done')
+
+
+def test_prefix_keeps_bracketed_message_text():
+    assert message('[12:00:00] [Server thread/INFO]: [Server] hello') == '[Server] hello'
+    assert message('plain line') == 'plain line'
+
+
+def test_server_ready_on_paper():
+    assert app.SERVER_READY_PATTERN.search(message('[12:00:00 INFO]: Done (5.1s)! For help, type "help"'))
+    assert app.SERVER_READY_PATTERN.search(message('[12:00:00] [Server thread/INFO]: Done (12,345s)! For help'))
+    assert not app.SERVER_READY_PATTERN.search(message('[12:00:00 INFO]: Preparing spawn area: 84%'))
+
+
+def test_player_tracker_parses_paper_lines():
+    tracker = app.PlayerTracker('paper-test')
+    app.online_players.pop('paper-test', None)
+    for line in ('[12:00:00 INFO]: Steve joined the game',
+                 '[12:00:01 INFO]: Alex joined the game',
+                 '[12:00:02 INFO]: Steve left the game'):
+        tracker.parse_line(message(line))
+    assert sorted(app.online_players['paper-test']) == ['Alex']
+    tracker.parse_line(message('[12:00:03 INFO]: There are 2 of a max of 20 players online: Alex, Notch'))
+    assert sorted(app.online_players['paper-test']) == ['Alex', 'Notch']
+    app.online_players.pop('paper-test', None)
+
+
+def test_hot_backup_save_wait_matches_paper(tmp_path):
+    log_file = tmp_path / 'latest.log'
+    log_file.write_text('[12:00:00 INFO]: Saving the game (this may take a moment!)\n'
+                        '[12:00:01 INFO]: Saved the game\n', encoding='utf-8')
+    assert app.wait_for_log_line(str(log_file), 0, app.SAVE_COMPLETE_PATTERN, 1)